@@ -0,0 +1,148 @@
+import asyncio
+import os
+from typing import Any, AsyncIterator, NamedTuple, Optional, Union
+from serial import Serial
+
+from gimbal import (
+    CMD_CONFIRM, CMD_CONTROL, CMD_MOTORS_OFF, CMD_MOTORS_ON, CMD_REALTIME_DATA_3, CMD_REALTIME_DATA_4,
+    BoardInfo, BoardInfoReq, Confirm, ControlReq, FrameEncoder, FrameParser, MotorsOffReq, RealtimeData3,
+    ResponseRouter, compiled_struct, decode_message, request_key
+)
+
+
+class AsyncGimbal:
+    """
+    asyncio counterpart of Gimbal. The port is driven by the event loop's fd
+    readiness callbacks instead of blocking reads, so any number of coroutines
+    can have requests in flight:
+
+        async with AsyncGimbal('/dev/ttyUSB0') as gimbal:
+            await gimbal.control_angle(0, 30, 0)
+    """
+    def __init__(self, port: str, baudrate: int = 115200, timeout: Optional[float] = 10, **kwargs):
+        self.serial = Serial(port, baudrate=baudrate, timeout=0, write_timeout=0, **kwargs)
+        self.timeout = timeout
+        self.encoder = FrameEncoder()
+        # the encoder reuses one buffer, so a frame must be written out before the next is encoded
+        self.write_lock = asyncio.Lock()
+        self.parser = FrameParser()
+        self.router = ResponseRouter()
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+
+    async def open(self):
+        if self.loop is None:
+            self.loop = asyncio.get_running_loop()
+            self.loop.add_reader(self.serial.fileno(), self._on_readable)
+
+    def close(self):
+        if self.loop is not None:
+            self.loop.remove_reader(self.serial.fileno())
+            self.loop = None
+        self.router.fail(ConnectionError('Gimbal connection closed'))
+        self.serial.close()
+
+    async def __aenter__(self) -> 'AsyncGimbal':
+        await self.open()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.close()
+
+    def _on_readable(self):
+        try:
+            data = os.read(self.serial.fileno(), 4096)
+        except BlockingIOError:
+            return
+        except OSError as e:
+            self.loop.remove_reader(self.serial.fileno())
+            self.router.fail(e)
+            return
+        self.parser.feed(data)
+        for message in self.parser:
+            self.router.route(message, decode_message)
+
+    async def _write(self, data: memoryview):
+        fd = self.serial.fileno()
+        while data:
+            try:
+                data = data[os.write(fd, data):]
+            except BlockingIOError:
+                writable = self.loop.create_future()
+                self.loop.add_writer(fd, writable.set_result, None)
+                try:
+                    await writable
+                finally:
+                    self.loop.remove_writer(fd)
+
+    async def write_message(self, payload: Union[int, NamedTuple]):
+        await self.open()
+        async with self.write_lock:
+            if isinstance(payload, int):
+                await self._write(self.encoder.encode(payload))
+            else:
+                command_id, fmt, _ = payload.format()
+                await self._write(self.encoder.encode_struct(command_id, compiled_struct(fmt), *payload))
+
+    def expect(self, key) -> asyncio.Future:
+        return self.router.expect(key, asyncio.get_running_loop().create_future())
+
+    async def wait(self, future: asyncio.Future, key) -> Any:
+        try:
+            return await asyncio.wait_for(future, self.timeout)
+        except asyncio.TimeoutError:
+            self.router.discard(key, future)
+            raise TimeoutError(f'No response {key} received from gimbal')
+
+    async def request(self, req: Union[int, NamedTuple], key=None) -> Any:
+        key = request_key(req) if key is None else key
+        future = self.expect(key)
+        try:
+            await self.write_message(req)
+        except BaseException:
+            self.router.discard(key, future)
+            raise
+        return await self.wait(future, key)
+
+    async def board_info(self, cfg: int = 0) -> BoardInfo:
+        return await self.request(BoardInfoReq(cfg))
+
+    async def motors_on(self) -> bool:
+        result = await self.request(CMD_MOTORS_ON)
+        assert isinstance(result, Confirm)
+        assert result.cmd_id == CMD_MOTORS_ON
+        return True
+
+    async def motors_off(self, mode=0) -> bool:
+        result = await self.request(MotorsOffReq(mode))
+        assert isinstance(result, Confirm)
+        assert result.cmd_id == CMD_MOTORS_OFF
+        return True
+
+    async def control_angle(self, roll: float, pitch: float, yaw: float, auto=True) -> bool:
+        done_key = CMD_CONFIRM, CMD_CONTROL, b'\x01'
+        done = self.expect(done_key) if auto else None
+        try:
+            result = await self.request(ControlReq.angles(roll, pitch, yaw, auto))
+        except BaseException:
+            if done is not None:
+                self.router.discard(done_key, done)
+                done.cancel()
+            raise
+        assert isinstance(result, Confirm)
+        if done is None:
+            return False
+        await self.wait(done, done_key)
+        return True
+
+    async def realtime_data(self, ver=3) -> Any:
+        command_id = CMD_REALTIME_DATA_3 if ver == 3 else CMD_REALTIME_DATA_4
+        return await self.request(command_id, key=command_id)
+
+    async def realtime(self, period: float = 0) -> AsyncIterator[RealtimeData3]:
+        """
+        Poll CMD_REALTIME_DATA_3, yielding every reply and then sleeping for period seconds.
+        """
+        while True:
+            yield await self.realtime_data()
+            if period:
+                await asyncio.sleep(period)
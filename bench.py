@@ -0,0 +1,264 @@
+"""
+Benchmarks of the protocol codec, payload decoding and frame capture paths.
+
+    python bench.py                  # run and print the report
+    python bench.py --save           # also store the results as the baseline
+    python bench.py --compare        # fail if slower than the stored baseline
+
+Per-call latency percentiles and throughput come from timing every call;
+allocations are measured in a separate tracemalloc pass: the transient peak
+per call and the number of memory blocks still held afterwards.
+"""
+from argparse import ArgumentParser
+from typing import Any, Callable, Dict, List, Optional
+from time import perf_counter_ns, sleep
+from threading import Thread
+import json
+import os
+import struct
+import sys
+import tracemalloc
+
+import numpy as np
+
+from gimbal import (
+    CMD_REALTIME_DATA_3, ControlReq, FrameEncoder, GimbalBase, Message, RealtimeData3, compile_decoder,
+    compiled_struct, decode_message, deserialize
+)
+from frames import FrameRing
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bench_baseline.json')
+
+
+class MemorySerial:
+    """
+    Transport reading from a bytes buffer, delivering at most chunk bytes per
+    read like a serial driver would.
+    """
+    def __init__(self, data: bytes, chunk: int = 256, timeout: Optional[float] = 0):
+        self.data = memoryview(data)
+        self.pos = 0
+        self.chunk = chunk
+        self.timeout = timeout
+
+    @property
+    def in_waiting(self) -> int:
+        return min(self.chunk, len(self.data) - self.pos)
+
+    def read(self, size: int = 1) -> bytes:
+        size = min(size, len(self.data) - self.pos)
+        self.pos += size
+        return bytes(self.data[self.pos - size:self.pos])
+
+    def write(self, data: bytes) -> int:
+        return len(data)
+
+    def close(self):
+        pass
+
+
+class MemoryGimbal(GimbalBase, MemorySerial):
+    pass
+
+
+def percentile(values: List[int], fraction: float) -> float:
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def report(name: str, timings: List[int], items: int = 1, allocations: Optional[Dict[str, float]] = None) -> Dict[str, Any]:
+    timings = sorted(timings)
+    total = sum(timings)
+    result = {
+        'name': name,
+        'calls': len(timings),
+        'per_s': len(timings) * items / total * 1e9 if total else 0.0,
+        'p50_us': percentile(timings, 0.5) / 1e3,
+        'p90_us': percentile(timings, 0.9) / 1e3,
+        'p99_us': percentile(timings, 0.99) / 1e3,
+    }
+    result.update(allocations or {})
+    return result
+
+
+def allocations(fn: Callable[[], Any], calls: int) -> Dict[str, float]:
+    blocks = sys.getallocatedblocks()
+    for _ in range(calls):
+        fn()
+    held = sys.getallocatedblocks() - blocks
+    tracemalloc.start()
+    try:
+        peaks = []
+        for _ in range(calls):
+            tracemalloc.reset_peak()
+            start, _ = tracemalloc.get_traced_memory()
+            fn()
+            _, peak = tracemalloc.get_traced_memory()
+            peaks.append(peak - start)
+    finally:
+        tracemalloc.stop()
+    return {'peak_bytes': sorted(peaks)[len(peaks) // 2], 'held_blocks': held / calls}
+
+
+def timeit(name: str, fn: Callable[[], Any], calls: int = 20000, warmup: int = 1000) -> Dict[str, Any]:
+    for _ in range(warmup):
+        fn()
+    timings = []
+    for _ in range(calls):
+        start = perf_counter_ns()
+        fn()
+        timings.append(perf_counter_ns() - start)
+    return report(name, timings, allocations=allocations(fn, min(calls, 1000)))
+
+
+def realtime_payload() -> bytes:
+    fmt = RealtimeData3.format().struct_format
+    return struct.pack(fmt, *range(6), 0, 0, 0, b'abc', *range(6), *range(100, 109), 1000, 0, 0, 1260, 0, 0, 0, 1, 2, 3)
+
+
+def bench_protocol() -> List[Dict[str, Any]]:
+    payload = realtime_payload()
+    req = ControlReq.angles(0, 30, -15)
+    control_struct = compiled_struct(ControlReq.format().struct_format)
+    encoder = FrameEncoder()
+    message = Message.create(CMD_REALTIME_DATA_3, payload)
+    items = list(compiled_struct(RealtimeData3.format().struct_format).unpack(payload))
+    decoder = compile_decoder(RealtimeData3)
+    return [
+        timeit('Message.crc16 (63 B)', lambda: Message.crc16(payload)),
+        timeit('Message.pack (ControlReq)', lambda: Message.create(67, control_struct.pack(*req)).pack()),
+        timeit('FrameEncoder.encode_struct', lambda: encoder.encode_struct(67, control_struct, *req)),
+        timeit('decode_message (RealtimeData3)', lambda: decode_message(message)),
+        timeit('compile_decoder (RealtimeData3)', lambda: decoder(payload)),
+        timeit('deserialize (RealtimeData3)', lambda: deserialize(RealtimeData3, list(items))),
+    ]
+
+
+def bench_read_message(frames: int = 20000) -> List[Dict[str, Any]]:
+    data = Message.create(CMD_REALTIME_DATA_3, realtime_payload()).pack() * frames
+    gimbal = MemoryGimbal(data)
+    timings = []
+    for _ in range(frames):
+        start = perf_counter_ns()
+        gimbal.read_message()
+        timings.append(perf_counter_ns() - start)
+    allocated = MemoryGimbal(data)
+    return [report('Gimbal.read_message (stream)', timings, allocations=allocations(allocated.read_message, 1000))]
+
+
+def bench_frame_ring(width: int = 1920, height: int = 1080, channels: int = 4) -> List[Dict[str, Any]]:
+    data = np.zeros((height, width, channels), np.uint8)
+    ring = FrameRing()
+
+    def checkout():
+        ring.checkout().release()
+
+    return [
+        timeit(f'FrameRing.write ({width}x{height}x{channels})', lambda: ring.write(data, 0.0), calls=500, warmup=10),
+        timeit('FrameRing.checkout', checkout),
+    ]
+
+
+def bench_isource(frames: int = 300, width: int = 1920, height: int = 1080, fmt: str = 'BGRx') -> List[Dict[str, Any]]:
+    try:
+        from isource import ISource, Gst, init_gstreamer
+        init_gstreamer()
+    except (ImportError, ValueError) as e:
+        print(f'Skipping ISource benchmarks: {e}')
+        return []
+    src = ISource(source=f'videotestsrc num-buffers={frames}')
+    src.set_format(width, height, 30, fmt=fmt)
+    callback_timings: List[int] = []
+
+    def timed_callback(sink, obj):
+        start = perf_counter_ns()
+        result = ISource.callback(sink, obj)
+        callback_timings.append(perf_counter_ns() - start)
+        return result
+
+    sink = src.pipeline.get_by_name('sink')
+    sink.set_property('emit-signals', True)
+    sink.connect('new-sample', timed_callback, src)
+
+    read_timings: List[int] = []
+    running = True
+
+    def reader():
+        while running:
+            start = perf_counter_ns()
+            frame = src.checkout()
+            if frame is not None:
+                read_timings.append(perf_counter_ns() - start)
+                frame.release()
+            sleep(0.001)
+
+    thread = Thread(target=reader, daemon=True)
+    start = perf_counter_ns()
+    src.pipeline.set_state(Gst.State.PLAYING)
+    thread.start()
+    message = src.pipeline.get_bus().timed_pop_filtered(60 * Gst.SECOND, Gst.MessageType.EOS | Gst.MessageType.ERROR)
+    elapsed = perf_counter_ns() - start
+    running = False
+    thread.join()
+    src.pipeline.set_state(Gst.State.NULL)
+    if message is None or message.type == Gst.MessageType.ERROR:
+        print('ISource benchmark pipeline failed:', message.parse_error() if message else 'timeout')
+        return []
+    print('ISource frames received: {}, dropped: {}, skipped: {}'.format(*src.stats()))
+    callback = report(f'ISource.callback ({width}x{height} {fmt})', callback_timings)
+    callback['per_s'] = len(callback_timings) / elapsed * 1e9
+    return [callback, report(f'ISource.checkout ({width}x{height} {fmt})', read_timings)]
+
+
+def compare(results: List[Dict[str, Any]], baseline: List[Dict[str, Any]], tolerance: float) -> List[str]:
+    previous = {item['name']: item for item in baseline}
+    regressions = []
+    for item in results:
+        base = previous.get(item['name'])
+        if base is None:
+            continue
+        if item['p50_us'] > base['p50_us'] * (1 + tolerance):
+            regressions.append(f"{item['name']}: p50 {base['p50_us']:.2f} -> {item['p50_us']:.2f} us")
+        if item['per_s'] < base['per_s'] / (1 + tolerance):
+            regressions.append(f"{item['name']}: {base['per_s']:.0f} -> {item['per_s']:.0f} /s")
+    return regressions
+
+
+def print_report(results: List[Dict[str, Any]]):
+    print(f"{'benchmark':40} {'per s':>12} {'p50 us':>9} {'p90 us':>9} {'p99 us':>9} {'peak B':>8} {'held':>6}")
+    for item in results:
+        print(f"{item['name']:40} {item['per_s']:12.0f} {item['p50_us']:9.2f} {item['p90_us']:9.2f} "
+              f"{item['p99_us']:9.2f} {item.get('peak_bytes', 0):8.0f} {item.get('held_blocks', 0):6.2f}")
+
+
+def main():
+    parser = ArgumentParser(description='Benchmark protocol and capture hot paths')
+    parser.add_argument('--save', action='store_true', help='Store results as the new baseline')
+    parser.add_argument('--compare', action='store_true', help='Exit with error on regressions against the baseline')
+    parser.add_argument('--baseline', default=BASELINE, help='Baseline file')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='Allowed slowdown, 0.25 = 25%%')
+    parser.add_argument('--no-video', action='store_true', help='Skip the GStreamer benchmarks')
+    args = parser.parse_args()
+
+    results = bench_protocol() + bench_read_message() + bench_frame_ring()
+    if not args.no_video:
+        results += bench_isource()
+    print_report(results)
+
+    if args.compare and not os.path.exists(args.baseline):
+        if not args.save:
+            sys.exit(f'No baseline at {args.baseline}, create one with --save')
+        print(f'No baseline at {args.baseline} yet, saving this run as the baseline')
+    elif args.compare:
+        with open(args.baseline) as file:
+            regressions = compare(results, json.load(file), args.tolerance)
+        for line in regressions:
+            print('REGRESSION', line)
+        if regressions:
+            sys.exit(1)
+    if args.save:
+        with open(args.baseline, 'w') as file:
+            json.dump(results, file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+from typing import Dict, Iterable, List, NamedTuple, Optional
+from time import monotonic
+
+from frames import FrameRef
+from isource import ISource
+
+
+class GrabSet(NamedTuple):
+    frames: Dict[str, FrameRef]  # by camera serial
+    timestamp: float  # mean capture time
+    spread: float  # seconds between the earliest and the latest frame
+
+    def release(self):
+        for frame in self.frames.values():
+            frame.release()
+
+    def __enter__(self) -> 'GrabSet':
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+
+class CameraStats(NamedTuple):
+    serial: str
+    fps: float  # since the previous stats() call
+    received: int
+    dropped: int
+    skipped: int
+
+
+class CameraManager:
+    """
+    Several cameras in one process, all running on the same monotonic clock
+    with a common base time, so their frame timestamps are comparable.
+
+        cameras = CameraManager()
+        cameras.set_format(1920, 1080, 30)
+        cameras.play()
+        with cameras.grab(tolerance=0.005) as grab:
+            for serial, frame in grab.frames.items():
+                ...
+
+    serials selects cameras, by default all found; other arguments go to
+    every ISource.
+    """
+    def __init__(self, serials: Optional[Iterable[str]] = None, **source_args):
+        if serials is None:
+            serials = [device.serial for device in ISource.list_devices(print_list=False)]
+        self.sources: Dict[str, ISource] = {serial: ISource(serial, **source_args) for serial in serials}
+        if not self.sources:
+            raise RuntimeError('No cameras to capture from')
+        self.last_stats = {serial: (monotonic(), 0) for serial in self.sources}
+
+    def __getitem__(self, serial: str) -> ISource:
+        return self.sources[serial]
+
+    def set_format(self, width: int, height: int, fps: int, fmt='BGRx'):
+        for source in self.sources.values():
+            source.set_format(width, height, fps, fmt=fmt)
+
+    def play(self):
+        base_time = ISource.clock().get_time()
+        for source in self.sources.values():
+            source.play(base_time)
+
+    def stop(self):
+        for source in self.sources.values():
+            source.stop()
+
+    def grab(self, tolerance: float = 0.005, timeout: Optional[float] = 1.0,
+             after: Optional[float] = None) -> Optional[GrabSet]:
+        """
+        One frame per camera, captured within tolerance seconds of each other
+        and not before after (monotonic time). The camera with the earliest
+        frame is advanced until the set fits. Returns None on timeout.
+        """
+        deadline = None if timeout is None else monotonic() + timeout
+        frames: Dict[str, FrameRef] = {}
+
+        def remaining() -> Optional[float]:
+            return None if deadline is None else max(0.0, deadline - monotonic())
+
+        try:
+            for serial, source in self.sources.items():
+                frame = source.ring.wait(0, after, remaining())
+                if frame is None:
+                    return None
+                frames[serial] = frame
+            while True:
+                earliest = min(frames, key=lambda s: frames[s].timestamp)
+                latest = max(frame.timestamp for frame in frames.values())
+                spread = latest - frames[earliest].timestamp
+                if spread <= tolerance:
+                    result = GrabSet(frames, sum(f.timestamp for f in frames.values()) / len(frames), spread)
+                    frames = {}
+                    return result
+                frame = self.sources[earliest].ring.wait(frames[earliest].seq, latest - tolerance, remaining())
+                if frame is None:
+                    return None
+                frames[earliest].release()
+                frames[earliest] = frame
+        finally:
+            for frame in frames.values():
+                frame.release()
+
+    def stats(self) -> List[CameraStats]:
+        result = []
+        now = monotonic()
+        for serial, source in self.sources.items():
+            stats = source.stats()
+            since, received = self.last_stats[serial]
+            fps = (stats.received - received) / (now - since) if now > since else 0.0
+            self.last_stats[serial] = now, stats.received
+            result.append(CameraStats(serial, fps, *stats))
+        return result
@@ -0,0 +1,160 @@
+from typing import Deque, NamedTuple, Optional, Tuple
+from collections import deque
+from concurrent.futures import Future
+from threading import Thread, Lock, Event
+from time import monotonic, sleep
+
+from gimbal import CMD_CONFIRM, CMD_CONTROL, ControlReq, GimbalBase
+
+
+class ControlStats(NamedTuple):
+    sent: int
+    coalesced: int
+    missed_deadlines: int
+    confirmed: int
+    unconfirmed: int
+    rate: float
+    confirm_latency: float
+
+
+class ControlStreamer:
+    """
+    Sends CMD_CONTROL setpoints at a fixed rate from a scheduler thread
+    without waiting for confirmations. Only the newest setpoint goes out on
+    each tick; older ones that were never sent are counted as coalesced.
+    Confirmations are matched in the background through the gimbal reader
+    thread, which is started if needed.
+
+        with ControlStreamer(gimbal, rate=100) as streamer:
+            streamer.set_speeds(0, 5.0, -2.5)
+            ...
+            print(streamer.stats())
+
+    With repeat=True the last setpoint is resent on every tick even if it did
+    not change, which keeps speed control alive on the controller side.
+    """
+    confirm_key = CMD_CONFIRM, CMD_CONTROL
+
+    def __init__(self, gimbal: GimbalBase, rate: float = 100.0, repeat: bool = False,
+                 confirm_timeout: float = 0.5, window: int = 100):
+        self.gimbal = gimbal
+        self.period = 1.0 / rate
+        self.repeat = repeat
+        self.confirm_timeout = confirm_timeout
+        self.lock = Lock()
+        self.setpoint: Optional[ControlReq] = None
+        self.fresh = False
+        self.stopped = Event()
+        self.thread: Optional[Thread] = None
+        self.in_flight: Deque[Tuple[float, Future]] = deque()
+        self.send_times: Deque[float] = deque(maxlen=window)
+        self.sent = 0
+        self.coalesced = 0
+        self.missed_deadlines = 0
+        self.confirmed = 0
+        self.unconfirmed = 0
+        self.confirm_time = 0.0
+
+    def set(self, req: ControlReq):
+        with self.lock:
+            if self.fresh:
+                self.coalesced += 1
+            self.setpoint = req
+            self.fresh = True
+
+    def set_angles(self, roll: float, pitch: float, yaw: float):
+        self.set(ControlReq.angles(roll, pitch, yaw, auto=False))
+
+    def set_speeds(self, roll: float, pitch: float, yaw: float):
+        self.set(ControlReq.speeds(roll, pitch, yaw))
+
+    def start(self) -> 'ControlStreamer':
+        if self.thread is None:
+            self.gimbal.start_reader()
+            self.stopped.clear()
+            self.thread = Thread(target=self._run, name='gimbal-control', daemon=True)
+            self.thread.start()
+        return self
+
+    def stop(self):
+        """
+        Stop the scheduler. A setpoint given since the last tick is still sent,
+        so stop() right after set_speeds(0, 0, 0) does stop the gimbal.
+        """
+        if self.thread is not None:
+            self.stopped.set()
+            self.thread.join()
+            self.thread = None
+            with self.lock:
+                req = self.setpoint if self.fresh else None
+                self.fresh = False
+            if req is not None:
+                self.gimbal.write_message(req)
+                self.sent += 1
+        for _, future in self.in_flight:
+            self.gimbal.router.discard(self.confirm_key, future)
+        self.in_flight.clear()
+
+    def __enter__(self) -> 'ControlStreamer':
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def _run(self):
+        deadline = monotonic()
+        while not self.stopped.is_set():
+            now = monotonic()
+            if now < deadline:
+                sleep(deadline - now)
+                now = monotonic()
+            late = int((now - deadline) / self.period)
+            if late:
+                self.missed_deadlines += late
+                deadline += late * self.period
+            deadline += self.period
+
+            with self.lock:
+                req = self.setpoint if self.fresh or self.repeat else None
+                self.fresh = False
+            if req is not None:
+                self._send(req, now)
+            self._check_confirms(monotonic())
+
+    def _send(self, req: ControlReq, now: float):
+        future = self.gimbal.expect(self.confirm_key)
+        try:
+            self.gimbal.write_message(req)
+        except BaseException:
+            self.gimbal.router.discard(self.confirm_key, future)
+            raise
+        future.add_done_callback(lambda done, sent=now: self._confirmed(done, sent))
+        self.in_flight.append((now, future))
+        self.send_times.append(now)
+        self.sent += 1
+
+    def _confirmed(self, future: Future, sent: float):
+        # called from the reader thread, or wherever the router failed the future
+        if future.cancelled() or future.exception() is not None:
+            self.unconfirmed += 1
+            return
+        self.confirmed += 1
+        self.confirm_time += monotonic() - sent
+
+    def _check_confirms(self, now: float):
+        in_flight = self.in_flight
+        while in_flight:
+            sent, future = in_flight[0]
+            if not future.done():
+                if now - sent <= self.confirm_timeout:
+                    break
+                self.gimbal.router.discard(self.confirm_key, future)
+                self.unconfirmed += 1
+            in_flight.popleft()
+
+    def stats(self) -> ControlStats:
+        times = list(self.send_times)
+        rate = (len(times) - 1) / (times[-1] - times[0]) if len(times) > 1 and times[-1] > times[0] else 0.0
+        latency = self.confirm_time / self.confirmed if self.confirmed else 0.0
+        return ControlStats(self.sent, self.coalesced, self.missed_deadlines,
+                            self.confirmed, self.unconfirmed, rate, latency)
@@ -0,0 +1,285 @@
+from typing import List, Optional, Tuple
+from struct import Struct, pack
+from threading import Thread, Event
+from queue import Queue, Empty
+from select import select
+from time import monotonic, sleep
+import random
+import socket
+import os
+import tty
+
+from serial.urlhandler.protocol_socket import Serial as SocketSerial
+
+from gimbal import (
+    ANGLE_UNIT, SPEED_UNIT, GYRO_UNIT, MODE_NO_CONTROL, MODE_SPEED, MODE_ANGLE, MODE_SPEED_ANGLE,
+    CONTROL_FLAG_AUTO_TASK, CMD_BOARD_INFO, CMD_CONFIRM, CMD_CONTROL, CMD_DATA_STREAM_INTERVAL, CMD_MOTORS_OFF,
+    CMD_MOTORS_ON, CMD_REALTIME_DATA_3, CMD_REALTIME_DATA_CUSTOM, BoardInfo, ControlReq, DataStreamIntervalReq,
+    FrameEncoder, FrameParser, GimbalBase, Message, RealtimeCustomLayout, RealtimeData3, RealtimeDataCustom,
+    compiled_struct
+)
+
+
+def _to_angle(value: float) -> int:
+    return max(-32768, min(32767, round(value / ANGLE_UNIT)))
+
+
+class Emulator:
+    """
+    In-process SimpleBGC controller speaking the subset of the protocol used
+    by gimbal.py, for testing and measuring the client without hardware.
+
+        emulator = Emulator(slew_rate=90, latency=0.005)
+        gimbal = Gimbal(emulator.serve_pty(), baudrate=115200, timeout=1)
+
+    baudrate throttles the replies to the given line speed (None disables it),
+    slew_rate limits motion in degrees/s, latency delays every reply and
+    corruption is the probability of a flipped bit per sent byte.
+    """
+    def __init__(self, baudrate: Optional[int] = 115200, slew_rate: float = 60.0, latency: float = 0.0,
+                 corruption: float = 0.0, seed: Optional[int] = None, tick: float = 0.002):
+        self.baudrate = baudrate
+        self.slew_rate = slew_rate
+        self.latency = latency
+        self.corruption = corruption
+        self.tick = tick
+        self.random = random.Random(seed)
+
+        self.motors_on = False
+        self.angles = [0.0, 0.0, 0.0]
+        self.targets = [0.0, 0.0, 0.0]
+        self.rates = [0.0, 0.0, 0.0]
+        self.modes = [MODE_NO_CONTROL] * 3
+        self.speeds = [0.0, 0.0, 0.0]
+        self.auto_task = False
+        self.streams = {}
+        self.received = 0
+        self.sent = 0
+
+        self.encoder = FrameEncoder()
+        self.output: Queue = Queue()
+        self.stopped = Event()
+        self.threads: List[Thread] = []
+        self.fds: List[int] = []
+        self.sockets: List[socket.socket] = []
+
+    def serve_pty(self) -> str:
+        """
+        Serve on a new pseudo terminal and return the device name for the client.
+        """
+        master, slave = os.openpty()
+        tty.setraw(master)
+        tty.setraw(slave)
+        self.fds += [master, slave]
+        self._start(master, master)
+        return os.ttyname(slave)
+
+    def serve_tcp(self, host: str = '127.0.0.1', port: int = 0) -> Tuple[str, int]:
+        """
+        Accept one client on a TCP socket; connect with SocketGimbal(f'socket://{host}:{port}').
+        """
+        server = socket.create_server((host, port))
+        self.sockets.append(server)
+
+        def accept():
+            try:
+                connection, _ = server.accept()
+            except OSError:
+                return
+            connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self.sockets.append(connection)
+            self._start(connection.fileno(), connection.fileno())
+
+        thread = Thread(target=accept, name='emulator-accept', daemon=True)
+        thread.start()
+        self.threads.append(thread)
+        return server.getsockname()[:2]
+
+    def close(self):
+        self.stopped.set()
+        for thread in self.threads:
+            if thread.ident is not None:
+                thread.join(1)
+        for item in self.sockets:
+            item.close()
+        for fd in self.fds:
+            os.close(fd)
+        self.sockets, self.fds = [], []
+
+    def _start(self, read_fd: int, write_fd: int):
+        for target, name, fd in ((self._serve, 'emulator', read_fd), (self._write_loop, 'emulator-writer', write_fd)):
+            thread = Thread(target=target, args=(fd,), name=name, daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def _serve(self, fd: int):
+        parser = FrameParser()
+        last = monotonic()
+        while not self.stopped.is_set():
+            readable, _, _ = select([fd], [], [], self.tick)
+            if readable:
+                try:
+                    data = os.read(fd, 4096)
+                except OSError:
+                    return
+                if not data:
+                    return
+                parser.feed(data)
+                for message in parser:
+                    self.received += 1
+                    self.handle(message)
+            now = monotonic()
+            self.update(now - last)
+            last = now
+            self._stream(now)
+
+    def _write_loop(self, fd: int):
+        line_free = monotonic()
+        while not self.stopped.is_set():
+            try:
+                due, data = self.output.get(timeout=0.1)
+            except Empty:
+                continue
+            now = monotonic()
+            start = max(due, line_free)
+            if start > now:
+                sleep(start - now)
+            if self.baudrate:
+                line_free = max(start, monotonic()) + len(data) * 10 / self.baudrate
+                wait = line_free - monotonic()
+                if wait > 0:
+                    sleep(wait)
+            try:
+                os.write(fd, data)
+            except OSError:
+                return
+            self.sent += 1
+
+    def send(self, command_id: int, payload: bytes = b''):
+        data = bytearray(self.encoder.encode(command_id, payload))
+        if self.corruption:
+            for i in range(len(data)):
+                if self.random.random() < self.corruption:
+                    data[i] ^= 1 << self.random.randrange(8)
+        self.output.put((monotonic() + self.latency, bytes(data)))
+
+    def confirm(self, cmd_id: int, data: bytes = b''):
+        self.send(CMD_CONFIRM, bytes([cmd_id]) + data)
+
+    def handle(self, message: Message):
+        command_id = message.command_id
+        if command_id == CMD_BOARD_INFO:
+            info = BoardInfo(30, 2730, 0, 0, 0, 0, 0, bytes(3), 2730)
+            self.send(CMD_BOARD_INFO, pack(BoardInfo.format().struct_format, *info))
+        elif command_id == CMD_MOTORS_ON:
+            self.motors_on = True
+            self.confirm(CMD_MOTORS_ON)
+        elif command_id == CMD_MOTORS_OFF:
+            self.motors_on = False
+            self.rates = [0.0, 0.0, 0.0]
+            self.confirm(CMD_MOTORS_OFF)
+        elif command_id == CMD_CONTROL:
+            self.control(ControlReq(*compiled_struct(ControlReq.format().struct_format).unpack(message.payload)))
+        elif command_id == CMD_REALTIME_DATA_3:
+            self.send(CMD_REALTIME_DATA_3, self.realtime_data())
+        elif command_id == CMD_REALTIME_DATA_CUSTOM:
+            flags, = Struct('<I').unpack_from(message.payload)
+            self.send(CMD_REALTIME_DATA_CUSTOM, self.realtime_data_custom(flags))
+        elif command_id == CMD_DATA_STREAM_INTERVAL:
+            req = DataStreamIntervalReq(*compiled_struct(DataStreamIntervalReq.format().struct_format).unpack(message.payload))
+            if req.interval_ms:
+                flags, = Struct('<I').unpack_from(req.config)
+                self.streams[req.cmd_id] = [req.interval_ms / 1000, monotonic(), flags]
+            else:
+                self.streams.pop(req.cmd_id, None)
+            self.confirm(CMD_DATA_STREAM_INTERVAL)
+
+    def control(self, req: ControlReq):
+        auto = False
+        axes = ((req.roll_mode, req.roll_speed, req.roll_angle),
+                (req.pitch_mode, req.pitch_speed, req.pitch_angle),
+                (req.yaw_mode, req.yaw_speed, req.yaw_angle))
+        for axis, (mode, speed, angle) in enumerate(axes):
+            auto |= bool(mode & CONTROL_FLAG_AUTO_TASK)
+            mode &= 0x0F
+            self.modes[axis] = mode
+            self.speeds[axis] = speed * SPEED_UNIT
+            if mode in (MODE_ANGLE, MODE_SPEED_ANGLE):
+                self.targets[axis] = angle * ANGLE_UNIT
+        self.confirm(CMD_CONTROL)
+        if auto:
+            self.auto_task = True
+
+    def update(self, dt: float):
+        if not self.motors_on:
+            self.rates = [0.0, 0.0, 0.0]
+            return
+        for axis in range(3):
+            mode = self.modes[axis]
+            if mode == MODE_SPEED:
+                rate = max(-self.slew_rate, min(self.slew_rate, self.speeds[axis]))
+            elif mode in (MODE_ANGLE, MODE_SPEED_ANGLE):
+                limit = abs(self.speeds[axis]) if mode == MODE_ANGLE and self.speeds[axis] else self.slew_rate
+                error = self.targets[axis] - self.angles[axis]
+                rate = max(-limit, min(limit, error / dt if dt else 0.0))
+                if mode == MODE_SPEED_ANGLE:
+                    rate = max(-self.slew_rate, min(self.slew_rate, rate + self.speeds[axis]))
+            else:
+                rate = 0.0
+            self.rates[axis] = rate
+            self.angles[axis] += rate * dt
+            if mode == MODE_SPEED:
+                self.targets[axis] = self.angles[axis]
+        if self.auto_task and all(abs(t - a) < ANGLE_UNIT for t, a in zip(self.targets, self.angles)):
+            self.auto_task = False
+            self.confirm(CMD_CONTROL, b'\x01')
+
+    def _stream(self, now: float):
+        for command_id, stream in self.streams.items():
+            interval, due, flags = stream
+            if now < due:
+                continue
+            stream[1] = max(due + interval, now)
+            if self.output.qsize() > 1:
+                continue  # like the controller, skip stream data while the line is busy
+            if command_id == CMD_REALTIME_DATA_3:
+                self.send(command_id, self.realtime_data())
+            elif command_id == CMD_REALTIME_DATA_CUSTOM:
+                self.send(command_id, self.realtime_data_custom(flags))
+
+    def realtime_data(self) -> bytes:
+        angles = [_to_angle(a) for a in self.angles]
+        gyro = [max(-32768, min(32767, round(r / GYRO_UNIT))) for r in self.rates]
+        imu_data = [0, gyro[0], 0, gyro[1], 512, gyro[2]]
+        return pack(RealtimeData3.format().struct_format,
+                    *imu_data, 0, 0, 0, bytes(3), 0, 0, 0, 0, 0, 0,
+                    *angles, *angles, *(_to_angle(t) for t in self.targets),
+                    round(self.tick * 1e6), 0, 0, 1260, 1 if self.motors_on else 0, 0, 0,
+                    *((80, 80, 80) if self.motors_on else (0, 0, 0)))
+
+    def realtime_data_custom(self, flags: int) -> bytes:
+        layout = RealtimeCustomLayout(flags)
+        angles = [_to_angle(a) for a in self.angles]
+        values = {
+            'imu_angle': angles,
+            'target_angle': [_to_angle(t) for t in self.targets],
+            'target_speed': [round(r / SPEED_UNIT) for r in self.rates],
+            'frame_cam_angle': angles,
+            'gyro_data': [round(r / GYRO_UNIT) for r in self.rates],
+            'rc_data': [0] * 6,
+            'z_vector': [0.0, 0.0, 1.0],
+            'h_vector': [1.0, 0.0, 0.0],
+            'rc_channels': [0] * 18,
+            'acc_data': [0, 0, 512],
+            'imu_angle_rad': [a * 0.017453292519943295 for a in self.angles],
+        }
+        items = [round(monotonic() * 1000) % 65536]
+        for index, _, _ in layout.fields:
+            items += values[RealtimeDataCustom._fields[index]]
+        return layout.struct.pack(*items)
+
+
+class SocketGimbal(GimbalBase, SocketSerial):
+    """
+    Gimbal over pyserial's socket:// transport, e.g. to an Emulator.serve_tcp().
+    """
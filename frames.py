@@ -0,0 +1,160 @@
+from typing import Any, List, NamedTuple, Optional
+from threading import Condition
+from time import monotonic
+import numpy as np
+
+
+class FrameStats(NamedTuple):
+    received: int  # frames offered by the producer
+    dropped: int  # not stored because every buffer was checked out
+    skipped: int  # stored but replaced by a newer frame before anyone read it
+
+
+class FrameRef:
+    """
+    A frame checked out of a FrameRing. image is a view of the ring buffer,
+    valid until release(); use it as a context manager:
+
+        with ring.checkout() as frame:
+            cv2.imwrite('img.png', frame.bgr())
+
+    fmt describes the pixel layout of image as given by the producer, e.g.
+    an isource.FrameFormat.
+    """
+    __slots__ = 'ring', 'index', 'image', 'timestamp', 'seq', 'fmt'
+
+    def __init__(self, ring: 'FrameRing', index: int, image: np.ndarray, timestamp: float, seq: int, fmt: Any = None):
+        self.ring = ring
+        self.index = index
+        self.image = image
+        self.timestamp = timestamp
+        self.seq = seq
+        self.fmt = fmt
+
+    def bgr(self) -> np.ndarray:
+        """
+        The image converted to BGR if its format knows how, otherwise as is.
+        """
+        if self.fmt is None or not hasattr(self.fmt, 'to_bgr'):
+            return self.image
+        return self.fmt.to_bgr(self.image)
+
+    def release(self):
+        if self.ring is not None:
+            self.ring.release(self.index)
+            self.ring = self.image = None
+
+    def __enter__(self) -> 'FrameRef':
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+
+class FrameRing:
+    """
+    Pool of preallocated frame buffers between a producer thread (the appsink
+    callback) and consumers. The producer copies each frame once into a buffer
+    nobody holds and publishes it as the latest; consumers check the latest
+    frame out without copying or wait for a new one. The producer never
+    waits for consumers: if all buffers are checked out the frame is dropped
+    and counted.
+    """
+    def __init__(self, size: int = 4):
+        if size < 2:
+            raise ValueError('FrameRing needs at least 2 buffers')
+        self.lock = Condition()
+        self.buffers: List[Optional[np.ndarray]] = [None] * size
+        self.refs = [0] * size
+        self.seqs = [0] * size
+        self.timestamps = [0.0] * size
+        self.formats: List[Any] = [None] * size
+        self.latest = -1
+        self.seq = 0
+        self.read_seq = 0
+        self.received = 0
+        self.dropped = 0
+        self.skipped = 0
+
+    def _free_buffer(self) -> int:
+        size = len(self.buffers)
+        for i in range(1, size + 1):
+            index = (self.latest + i) % size
+            if not self.refs[index] and index != self.latest:
+                return index
+        return -1
+
+    def write(self, data: np.ndarray, timestamp: float, fmt: Any = None) -> int:
+        """
+        Store a copy of data (compacted if it is a strided view) as the latest
+        frame, return its sequence number or 0 if dropped.
+        """
+        with self.lock:
+            self.received += 1
+            index = self._free_buffer()
+            if index < 0:
+                self.dropped += 1
+                return 0
+            self.refs[index] = 1  # keep it from consumers and other writers while copying
+        buffer = self.buffers[index]
+        if buffer is None or buffer.shape != data.shape or buffer.dtype != data.dtype:
+            buffer = self.buffers[index] = np.empty_like(data)
+        np.copyto(buffer, data)
+        with self.lock:
+            self.refs[index] = 0
+            if self.latest >= 0 and self.seqs[self.latest] > self.read_seq:
+                self.skipped += 1
+            self.seq += 1
+            self.seqs[index] = self.seq
+            self.timestamps[index] = timestamp
+            self.formats[index] = fmt
+            self.latest = index
+            self.lock.notify_all()
+            return self.seq
+
+    def _checkout(self, index: int) -> FrameRef:
+        self.refs[index] += 1
+        seq = self.seqs[index]
+        self.read_seq = max(self.read_seq, seq)
+        return FrameRef(self, index, self.buffers[index], self.timestamps[index], seq, self.formats[index])
+
+    def checkout(self, after: int = 0) -> Optional[FrameRef]:
+        """
+        The latest frame if its sequence number is above after, otherwise None.
+        """
+        with self.lock:
+            index = self.latest
+            if index < 0 or self.seqs[index] <= after:
+                return None
+            return self._checkout(index)
+
+    def wait(self, after: Optional[int] = None, since: Optional[float] = None,
+             timeout: Optional[float] = None) -> Optional[FrameRef]:
+        """
+        Check out the first frame to arrive with a sequence number above after
+        (default: the latest one now) and a timestamp not before since.
+        Returns None on timeout.
+        """
+        deadline = None if timeout is None else monotonic() + timeout
+        with self.lock:
+            if after is None:
+                after = self.seq
+            while True:
+                index = self.latest
+                if index >= 0 and self.seqs[index] > after and (since is None or self.timestamps[index] >= since):
+                    return self._checkout(index)
+                if deadline is None:
+                    self.lock.wait()
+                else:
+                    remaining = deadline - monotonic()
+                    if remaining <= 0:
+                        return None
+                    self.lock.wait(remaining)
+
+    def release(self, index: int):
+        with self.lock:
+            self.refs[index] -= 1
+
+    def stats(self) -> FrameStats:
+        with self.lock:
+            return FrameStats(self.received, self.dropped, self.skipped)
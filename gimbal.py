@@ -1,8 +1,38 @@
 from abc import ABCMeta, abstractstaticmethod
-from typing import NamedTuple, Any, Optional, Tuple
+from typing import NamedTuple, Any, Optional, Tuple, Iterator, Iterable, Callable, Dict, Deque, List, Union
+from typing import get_args, get_origin, get_type_hints
 from serial import Serial
-from struct import calcsize, pack, unpack
-from time import sleep
+from struct import Struct, calcsize, pack, unpack, error as StructError
+from functools import lru_cache
+from time import sleep, monotonic
+from threading import Thread, Lock
+from collections import defaultdict, deque
+from bisect import bisect_left
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from serial import SerialException
+from queue import Queue, Empty
+
+
+CMD_REALTIME_DATA_3 = 23
+CMD_REALTIME_DATA_4 = 25
+CMD_CONFIRM = 67
+CMD_CONTROL = 67
+CMD_MOTORS_ON = 77
+CMD_DATA_STREAM_INTERVAL = 85
+CMD_BOARD_INFO = 86
+CMD_REALTIME_DATA_CUSTOM = 88
+CMD_MOTORS_OFF = 109
+
+ANGLE_UNIT = 0.02197265625  # degrees per unit of the 14-bit angle fields
+SPEED_UNIT = 0.1220740379  # degrees/s per unit of CMD_CONTROL speed fields
+GYRO_UNIT = 0.06103701895  # degrees/s per unit of gyro data
+
+# CMD_CONTROL modes
+MODE_NO_CONTROL = 0
+MODE_SPEED = 1
+MODE_ANGLE = 2
+MODE_SPEED_ANGLE = 3
+CONTROL_FLAG_AUTO_TASK = 1 << 6
 
 
 class MessageFormat(NamedTuple):
@@ -17,6 +47,24 @@ class Payload(metaclass=ABCMeta):
         ...
 
 
+def _crc16_tables(poly: int = 0x8005) -> Tuple[Tuple[int, ...], Tuple[int, ...]]:
+    # SimpleBGC feeds every data byte LSB first into an MSB first register.
+    # That is the same as running the reflected (right shifting) algorithm and
+    # bit-reversing the result, which needs a single lookup per byte.
+    reverse = tuple(int('{:08b}'.format(i)[::-1], 2) for i in range(256))
+    reflected_poly = int('{:016b}'.format(poly)[::-1], 2)
+    table = []
+    for index in range(256):
+        crc = index
+        for _ in range(8):
+            crc = (crc >> 1) ^ reflected_poly if crc & 1 else crc >> 1
+        table.append(crc)
+    return tuple(table), reverse
+
+
+_CRC16_TABLE, _REVERSE_BITS = _crc16_tables()
+
+
 class Message(NamedTuple):
     start_character: int
     command_id: int
@@ -26,21 +74,14 @@ class Message(NamedTuple):
 
     @staticmethod
     def crc16(data: bytes) -> int:
+        table = _CRC16_TABLE
         crc = 0
-        poly = 0x8005
         for c in data:
-            for b in range(8):
-                crc_bit = bool(crc >> 15)
-                crc = (crc << 1) & 0xFFFF
-                if bool(c & (1 << b)) != crc_bit:
-                    crc ^= poly
-        return crc
+            crc = (crc >> 8) ^ table[(crc ^ c) & 0xFF]
+        return (_REVERSE_BITS[crc & 0xFF] << 8) | _REVERSE_BITS[crc >> 8]
 
     def pack(self):
-        message_format = '<BBBB{}s'.format(self.payload_size)
-        data = pack(message_format, *self)
-        data += pack('<H', self.crc16(data[1:]))
-        return data
+        return bytes(FrameEncoder(self.payload_size).encode(self.command_id, self.payload))
 
     @staticmethod
     def create(command_id: int, payload: bytes = b'') -> 'Message':
@@ -69,6 +110,98 @@ class Message(NamedTuple):
         return Message(*message[:-1])
 
 
+class FrameEncoder:
+    """
+    Writes header, payload and CRC of outgoing frames into one reusable buffer.
+    The returned memoryview is valid until the next call.
+    """
+    header = Struct('<BBBB')
+    crc = Struct('<H')
+
+    def __init__(self, max_payload_size: int = 255):
+        self.buffer = bytearray(max_payload_size + 6)
+        self.view = memoryview(self.buffer)
+
+    def _finish(self, command_id: int, payload_size: int) -> memoryview:
+        view = self.view
+        self.header.pack_into(view, 0, 0x24, command_id, payload_size, (command_id + payload_size) % 256)
+        end = 4 + payload_size
+        self.crc.pack_into(view, end, Message.crc16(view[1:end]))
+        return view[:end + 2]
+
+    def encode(self, command_id: int, payload: bytes = b'') -> memoryview:
+        payload_size = len(payload)
+        self.view[4:4 + payload_size] = payload
+        return self._finish(command_id, payload_size)
+
+    def encode_struct(self, command_id: int, payload_struct: Struct, *values) -> memoryview:
+        payload_struct.pack_into(self.view, 4, *values)
+        return self._finish(command_id, payload_struct.size)
+
+
+class FrameParser:
+    """
+    Incremental parser of the incoming byte stream. Bytes are appended with
+    feed() and iterating yields every complete frame with valid header checksum
+    and CRC. Anything else is skipped up to the next start character.
+    """
+    def __init__(self):
+        self.buffer = bytearray()
+        self.start = 0
+        self.skipped = 0
+        self.header_errors = 0
+        self.crc_errors = 0
+
+    def feed(self, data: bytes):
+        if self.start:
+            if self.start >= len(self.buffer):
+                self.buffer.clear()
+            else:
+                del self.buffer[:self.start]
+            self.start = 0
+        self.buffer += data
+
+    def __len__(self):
+        return len(self.buffer) - self.start
+
+    def __iter__(self) -> Iterator[Message]:
+        buffer = self.buffer
+        pos = self.start
+        while True:
+            found = buffer.find(0x24, pos)
+            if found < 0:
+                self.skipped += len(buffer) - pos
+                self.start = len(buffer)
+                return
+            self.skipped += found - pos
+            pos = found
+            self.start = pos
+            if len(buffer) - pos < 4:
+                return
+            command_id, payload_size, header_checksum = buffer[pos + 1:pos + 4]
+            if (command_id + payload_size) % 256 != header_checksum:
+                self.header_errors += 1
+                self.skipped += 1
+                pos += 1
+                continue
+            end = pos + 4 + payload_size
+            if len(buffer) < end + 2:
+                return
+            if Message.crc16(buffer[pos + 1:end]) != buffer[end] | (buffer[end + 1] << 8):
+                self.crc_errors += 1
+                self.skipped += 1
+                pos += 1
+                continue
+            self.start = end + 2
+            yield Message(0x24, command_id, payload_size, header_checksum, bytes(buffer[pos + 4:end]))
+            pos = end + 2
+
+
+@lru_cache(maxsize=None)
+def compiled_struct(fmt: str) -> Struct:
+    return Struct(fmt)
+
+
 class BoardInfo(NamedTuple):
     board_ver: int
     firmware_ver: int
@@ -117,6 +250,30 @@ class ControlReq(NamedTuple):
     def format() -> MessageFormat:
         return MessageFormat(67, '<BBBhhhhhh')
 
+    @staticmethod
+    def angles(roll: float, pitch: float, yaw: float, auto=True) -> 'ControlReq':
+        mode = MODE_ANGLE
+        if auto:
+            mode |= CONTROL_FLAG_AUTO_TASK
+        return ControlReq(
+            mode, mode, mode,
+            0, round(roll / ANGLE_UNIT),
+            0, round(pitch / ANGLE_UNIT),
+            0, round(yaw / ANGLE_UNIT),
+        )
+
+    @staticmethod
+    def speeds(roll: float, pitch: float, yaw: float) -> 'ControlReq':
+        """
+        Rotate with the given speeds in degrees/s until the next command.
+        """
+        return ControlReq(
+            MODE_SPEED, MODE_SPEED, MODE_SPEED,
+            round(roll / SPEED_UNIT), 0,
+            round(pitch / SPEED_UNIT), 0,
+            round(yaw / SPEED_UNIT), 0,
+        )
+
 
 class ImuData(NamedTuple):
     acc_data: float
@@ -134,7 +291,7 @@ class Angles(NamedTuple):
 
     @staticmethod
     def from_items(r, p, y):
-        return Angles(r * 0.02197265625, p * 0.02197265625, y * 0.02197265625)
+        return Angles(r * ANGLE_UNIT, p * ANGLE_UNIT, y * ANGLE_UNIT)
 
 
 class RealtimeData3(NamedTuple):
@@ -165,106 +322,700 @@ class RealtimeData3(NamedTuple):
         return MessageFormat(23, '<6hHHB3s3hh2h9hHHBH6B')
 
 
+class DataStreamIntervalReq(NamedTuple):
+    """
+    Ask the controller to send cmd_id every interval_ms without further
+    requests; interval_ms=0 stops the stream.
+    """
+    cmd_id: int
+    interval_ms: int
+    config: bytes = bytes(8)
+    sync_to_data: int = 0
+    reserved: bytes = bytes(9)
+
+    @staticmethod
+    def format() -> MessageFormat:
+        return MessageFormat(85, '<BH8sB9s')
+
+
+# Fields of CMD_REALTIME_DATA_CUSTOM in the order they follow timestamp_ms
+# in the reply; each one is present only if its flag was requested.
+REALTIME_CUSTOM_IMU_ANGLES = 1 << 0
+REALTIME_CUSTOM_TARGET_ANGLES = 1 << 1
+REALTIME_CUSTOM_TARGET_SPEED = 1 << 2
+REALTIME_CUSTOM_FRAME_CAM_ANGLE = 1 << 3
+REALTIME_CUSTOM_GYRO_DATA = 1 << 4
+REALTIME_CUSTOM_RC_DATA = 1 << 5
+REALTIME_CUSTOM_Z_H_VECTORS = 1 << 6
+REALTIME_CUSTOM_RC_CHANNELS = 1 << 7
+REALTIME_CUSTOM_ACC_DATA = 1 << 8
+REALTIME_CUSTOM_IMU_ANGLES_RAD = 1 << 12
+
+_realtime_custom_fields = (
+    (REALTIME_CUSTOM_IMU_ANGLES, (('imu_angle', '3h', Angles.from_items),)),
+    (REALTIME_CUSTOM_TARGET_ANGLES, (('target_angle', '3h', Angles.from_items),)),
+    (REALTIME_CUSTOM_TARGET_SPEED, (('target_speed', '3h', None),)),
+    (REALTIME_CUSTOM_FRAME_CAM_ANGLE, (('frame_cam_angle', '3h', Angles.from_items),)),
+    (REALTIME_CUSTOM_GYRO_DATA, (('gyro_data', '3h', None),)),
+    (REALTIME_CUSTOM_RC_DATA, (('rc_data', '6h', None),)),
+    (REALTIME_CUSTOM_Z_H_VECTORS, (('z_vector', '3f', None), ('h_vector', '3f', None))),
+    (REALTIME_CUSTOM_RC_CHANNELS, (('rc_channels', '18h', None),)),
+    (REALTIME_CUSTOM_ACC_DATA, (('acc_data', '3h', None),)),
+    (REALTIME_CUSTOM_IMU_ANGLES_RAD, (('imu_angle_rad', '3f', None),)),
+)
+
+
+class RealtimeDataCustom(NamedTuple):
+    timestamp_ms: int
+    imu_angle: Optional[Angles] = None
+    target_angle: Optional[Angles] = None
+    target_speed: Optional[Tuple[int, int, int]] = None
+    frame_cam_angle: Optional[Angles] = None
+    gyro_data: Optional[Tuple[int, int, int]] = None
+    rc_data: Optional[Tuple[int, ...]] = None
+    z_vector: Optional[Tuple[float, float, float]] = None
+    h_vector: Optional[Tuple[float, float, float]] = None
+    rc_channels: Optional[Tuple[int, ...]] = None
+    acc_data: Optional[Tuple[int, int, int]] = None
+    imu_angle_rad: Optional[Tuple[float, float, float]] = None
+
+    @staticmethod
+    def format() -> MessageFormat:
+        # Only the timestamp is fixed, see RealtimeCustomLayout
+        return MessageFormat(88, '<H')
+
+
+class RealtimeCustomLayout:
+    """
+    Decoder of CMD_REALTIME_DATA_CUSTOM replies for a given set of
+    REALTIME_CUSTOM_* flags. The reply does not carry the flags, so whoever
+    requested the data has to keep the layout.
+    """
+    def __init__(self, flags: int):
+        supported = 0
+        fmt = '<H'
+        fields = []
+        for flag, items in _realtime_custom_fields:
+            supported |= flag
+            if flags & flag:
+                for name, item_fmt, convert in items:
+                    fmt += item_fmt
+                    fields.append((RealtimeDataCustom._fields.index(name), int(item_fmt[:-1]), convert))
+        if flags & ~supported:
+            raise ValueError(f'Unsupported realtime data flags: {flags & ~supported:#x}')
+        self.flags = flags
+        self.struct = Struct(fmt)
+        self.fields = fields
+
+    def decode(self, payload: bytes) -> RealtimeDataCustom:
+        items = self.struct.unpack(payload)
+        result: List[Any] = [None] * len(RealtimeDataCustom._fields)
+        result[0] = items[0]
+        pos = 1
+        for index, count, convert in self.fields:
+            value = items[pos:pos + count]
+            result[index] = value if convert is None else convert(*value)
+            pos += count
+        return RealtimeDataCustom(*result)
+
+
+class RealtimeDataCustomReq(NamedTuple):
+    flags: int
+    reserved: bytes = bytes(6)
+
+    @staticmethod
+    def format() -> MessageFormat:
+        return MessageFormat(88, '<I6s', RealtimeDataCustom)
+
+
 class Confirm(NamedTuple):
     cmd_id: int
     data: bytes
 
 
-payloads_map = {
-    86: BoardInfo,
-    23: RealtimeData3,
-}
+def _build_expression(types, namespace: Dict[str, Any], index: int) -> Tuple[List[str], int]:
+    """
+    Python expressions building values of the given field types from the
+    flat tuple `v` of unpacked items, starting at v[index].
+    """
+    parts = []
+    for ft in types:
+        if ft in (int, float, bytes):
+            parts.append(f'v[{index}]')
+            index += 1
+        elif hasattr(ft, '_fields'):
+            name = f'_t{len(namespace)}'
+            namespace[name] = ft
+            if hasattr(ft, 'from_items'):
+                size = len(ft._fields)
+                parts.append(f'{name}.from_items(*v[{index}:{index + size}])')
+                index += size
+            else:
+                items, index = _build_expression(get_type_hints(ft).values(), namespace, index)
+                parts.append(f'_new({name}, ({", ".join(items)},))')
+        elif get_origin(ft) is tuple:
+            items, index = _build_expression(get_args(ft), namespace, index)
+            parts.append(f'({", ".join(items)},)')
+        else:
+            raise TypeError(f'Can not deserialize field of type {ft}')
+    return parts, index
 
 
-def deserialize(target_type, items, types=None):
+@lru_cache(maxsize=None)
+def _compile_builder(target_type, types: Optional[Tuple[Any, ...]] = None) -> Tuple[Callable[[Any], Any], int]:
+    """
+    Function building target_type from a flat sequence of unpacked items,
+    and the number of items it consumes.
+    """
     if types is None:
-        types = map(getattr(target_type, '_field_types').get, getattr(target_type, '_fields'))
-    result = []
-    for ft in types:
-        if ft in [int, float, bytes]:
-            result.append(items.pop(0))
-        elif hasattr(ft, 'from_items'):
-            size = len(getattr(ft, '_fields'))
-            result.append(ft.from_items(*items[:size]))
-            for t in range(size):
-                items.pop(0)
-        elif hasattr(ft, '_fields') and hasattr(ft, '_field_types'):
-            result.append(deserialize(ft, items))
-        elif ft.__origin__ is tuple:
-            result.append(deserialize(tuple, items, ft.__args__))
-        else:
-            print()
-    return tuple(result) if target_type is tuple else target_type(*result)
+        types = tuple(get_type_hints(target_type).values())
+    namespace = {'_target': target_type, '_new': tuple.__new__}
+    parts, size = _build_expression(types, namespace, 0)
+    if target_type is tuple:
+        source = f'lambda v: ({", ".join(parts)},)'
+    else:
+        source = f'lambda v: _new(_target, ({", ".join(parts)},))'
+    return eval(source, namespace), size
+
+
+@lru_cache(maxsize=None)
+def compile_decoder(msg_type) -> Callable[[bytes], Any]:
+    """
+    Decoder of msg_type payloads: one precompiled struct.Struct unpack and a
+    generated constructor expression, so no reflection per message.
+    """
+    unpack_payload = compiled_struct(msg_type.format().struct_format).unpack
+    build, _ = _compile_builder(msg_type)
+    return lambda payload: build(unpack_payload(payload))
+
+
+payloads_map: Dict[int, Any] = {}
+
+
+def register_payload(msg_type):
+    payloads_map[msg_type.format().command_id] = msg_type
+    compile_decoder(msg_type)
+    return msg_type
+
+
+register_payload(BoardInfo)
+register_payload(RealtimeData3)
+
+
+def deserialize(target_type, items, types=None):
+    build, size = _compile_builder(target_type, None if types is None else tuple(types))
+    result = build(items)
+    del items[:size]
+    return result
+
+
+def decode_message(message: Message, custom_layout: Optional[RealtimeCustomLayout] = None) -> Any:
+    if message.command_id == CMD_REALTIME_DATA_CUSTOM and custom_layout is not None:
+        return custom_layout.decode(message.payload)
+    msg_type = payloads_map.get(message.command_id, None)
+    if msg_type is not None:
+        return compile_decoder(msg_type)(message.payload)
+    if message.command_id == 67:    # CMD_CONFIRM
+        fmt = f'<B{message.payload_size - 1}s'
+        return Confirm(*unpack(fmt, message.payload))
+    raise RuntimeError(f'Unknown response command_id {message.command_id}')
+
+
+def response_key(payload) -> Any:
+    """
+    Key that routes an incoming payload to the request waiting for it.
+    Confirmations are routed by the confirmed command id; the completion
+    confirmation of an automatic CMD_CONTROL move is kept apart from its ack.
+    """
+    if isinstance(payload, Confirm):
+        if payload.cmd_id == CMD_CONTROL and payload.data:
+            return CMD_CONFIRM, payload.cmd_id, payload.data
+        return CMD_CONFIRM, payload.cmd_id
+    if isinstance(payload, Message):
+        return payload.command_id
+    return payload.format().command_id
+
+
+def angle_error(target: float, angle: float) -> float:
+    return (target - angle + 180) % 360 - 180
+
+
+def is_settled(data: RealtimeData3, target: Optional[Angles] = None,
+               angle_tolerance: float = 0.2, rate_tolerance: float = 1.0) -> bool:
+    """
+    Whether IMU angles are within angle_tolerance degrees of target (the
+    controller's target_angle by default) and gyro rates below
+    rate_tolerance degrees/s on all axes.
+    """
+    if target is None:
+        target = data.target_angle
+    for t, a, imu in zip(target, data.imu_angle, data.imu_data):
+        if abs(angle_error(t, a)) > angle_tolerance or abs(imu.gyro_data * GYRO_UNIT) > rate_tolerance:
+            return False
+    return True
+
+
+def request_key(req: Union[int, NamedTuple]) -> Any:
+    if isinstance(req, int):
+        response = payloads_map.get(req)
+        return req if response is not None else (CMD_CONFIRM, req)
+    command_id, _, response = req.format()
+    return response.format().command_id if response is not None else (CMD_CONFIRM, command_id)
+
+
+class PoseSample(NamedTuple):
+    angles: Angles
+    gap: float  # seconds to the nearest sample, 0 if interpolated between two
+
+
+class AngleHistory:
+    """
+    Time-indexed buffer of the latest angle samples. at(t) interpolates the
+    attitude at any moment covered by the buffer.
+    """
+    def __init__(self, capacity: int = 4096):
+        self.capacity = capacity
+        self.lock = Lock()
+        self.times: List[float] = []
+        self.angles: List[Angles] = []
+
+    def __len__(self):
+        return min(len(self.times), self.capacity)
+
+    def add(self, timestamp: float, angles: Angles):
+        with self.lock:
+            if self.times and timestamp <= self.times[-1]:
+                return
+            self.times.append(timestamp)
+            self.angles.append(angles)
+            if len(self.times) >= 2 * self.capacity:
+                del self.times[:-self.capacity]
+                del self.angles[:-self.capacity]
+
+    def latest(self) -> Optional[Tuple[float, Angles]]:
+        with self.lock:
+            return (self.times[-1], self.angles[-1]) if self.times else None
+
+    def at(self, timestamp: float) -> Optional[PoseSample]:
+        with self.lock:
+            times = self.times
+            if not times:
+                return None
+            index = bisect_left(times, timestamp)
+            if index == 0:
+                return PoseSample(self.angles[0], times[0] - timestamp)
+            if index == len(times):
+                return PoseSample(self.angles[-1], timestamp - times[-1])
+            t0, t1 = times[index - 1], times[index]
+            a0, a1 = self.angles[index - 1], self.angles[index]
+        fraction = (timestamp - t0) / (t1 - t0)
+        return PoseSample(Angles(*(v0 + angle_error(v1, v0) * fraction for v0, v1 in zip(a0, a1))), 0.0)
+
+
+class ResponseRouter:
+    """
+    Hands decoded messages to the futures waiting for them, oldest first.
+    Messages nobody waits for go to the listeners.
+    """
+    def __init__(self):
+        self.lock = Lock()
+        self.pending: Dict[Any, Deque[Future]] = defaultdict(deque)
+        self.listeners: List[Callable[[Any], None]] = []
+
+    def add_listener(self, listener: Callable[[Any], None]):
+        self.listeners = self.listeners + [listener]
+
+    def remove_listener(self, listener: Callable[[Any], None]):
+        self.listeners = [item for item in self.listeners if item is not listener]
+
+    def expect(self, key, future):
+        with self.lock:
+            self.pending[key].append(future)
+        return future
+
+    def discard(self, key, future):
+        with self.lock:
+            try:
+                self.pending[key].remove(future)
+            except ValueError:
+                pass
+
+    def _take(self, key) -> Optional[Future]:
+        with self.lock:
+            waiting = self.pending.get(key)
+            while waiting:
+                future = waiting.popleft()
+                if not future.done():
+                    return future
+        return None
+
+    def dispatch(self, payload) -> bool:
+        future = self._take(response_key(payload))
+        if future is not None:
+            future.set_result(payload)
+            return True
+        self.notify(payload)
+        return False
+
+    def notify(self, payload):
+        for listener in self.listeners:
+            try:
+                listener(payload)
+            except Exception as e:
+                print(f'Listener {listener} failed: {e!r}')
+
+    def route(self, message: Message, decode: Callable[[Message], Any]):
+        """
+        Decode message and dispatch it. Messages of unknown commands are
+        dispatched as they are; one that does not decode, e.g. from other
+        firmware, fails the request waiting for its command and only goes to
+        the listeners, so nobody gets a raw Message in place of a typed reply.
+        """
+        try:
+            payload = decode(message)
+        except RuntimeError:
+            payload = message
+        except (StructError, ValueError) as e:
+            error = ValueError(f'Failed to decode command {message.command_id}: {e}')
+            # a confirmation too short to decode does not tell which command it confirms
+            future = self._take(message.command_id) if message.command_id != CMD_CONFIRM else None
+            if future is not None:
+                future.set_exception(error)
+            else:
+                print(error)
+            self.notify(message)
+            return
+        self.dispatch(payload)
+
+    def fail(self, exception: BaseException):
+        with self.lock:
+            pending = [f for waiting in self.pending.values() for f in waiting]
+            self.pending.clear()
+        for future in pending:
+            if not future.done():
+                future.set_exception(exception)
+
+
+class GimbalBase:
+    """
+    SimpleBGC protocol on top of any transport with the pyserial interface
+    (read, write, in_waiting, timeout). See Gimbal for the serial port one.
+    Pass record='file.log' to log all traffic, see recorder.py.
+    """
+    def __init__(self, *args, record: Optional[str] = None, **kwargs):
+        self.encoder = FrameEncoder()
+        self.parser = FrameParser()
+        self.write_lock = Lock()
+        self.router = ResponseRouter()
+        self.reader_thread: Optional[Thread] = None
+        self.custom_layout: Optional[RealtimeCustomLayout] = None
+        self.recorder = None
+        self.history = AngleHistory()
+        super(GimbalBase, self).__init__(*args, **kwargs)
+        if record is not None:
+            self.start_recording(record)
 
+    def start_recording(self, path: str):
+        from recorder import Recorder
+        self.stop_recording()
+        self.recorder = Recorder(path)
 
-class Gimbal(Serial):
-    def __init__(self, *args, **kwargs):
-        super(Gimbal, self).__init__(*args, **kwargs)
+    def stop_recording(self):
+        recorder, self.recorder = self.recorder, None
+        if recorder is not None:
+            recorder.close()
+
+    def start_reader(self):
+        """
+        Hand the port over to a background thread that routes every incoming
+        message to the request waiting for it, so requests from several
+        threads can be in flight at once.
+        """
+        if self.reader_thread is not None:
+            return
+        self.reader_thread = Thread(target=self._read_loop, name='gimbal-reader', daemon=True)
+        self.reader_thread.start()
+
+    def stop_reader(self):
+        thread = self.reader_thread
+        if thread is None:
+            return
+        self.reader_thread = None
+        if hasattr(self, 'cancel_read'):
+            self.cancel_read()
+        thread.join()
+
+    def _read_loop(self):
+        thread = self.reader_thread
+        try:
+            while self.reader_thread is thread:
+                data = self.read_chunk()
+                if not data:
+                    continue
+                self.parser.feed(data)
+                for message in self.parser:
+                    self.router.route(message, self.decode)
+        except (SerialException, OSError, EOFError) as e:
+            self.router.fail(e)
+        finally:
+            # whatever ends the loop, later requests must not wait for a reader that is gone
+            if self.reader_thread is thread:
+                self.reader_thread = None
+                self.router.fail(EOFError('Gimbal reader stopped'))
+
+    def close(self):
+        self.stop_reader()
+        super(GimbalBase, self).close()
+        self.stop_recording()
+
+    def read_chunk(self) -> bytes:
+        data = self.read(max(1, self.in_waiting))
+        if data and self.recorder is not None:
+            self.recorder.received(data)
+        return data
+
+    def read_frame(self) -> Message:
+        deadline = None if self.timeout is None else monotonic() + self.timeout
+        while True:
+            for message in self.parser:
+                return message
+            data = self.read_chunk()
+            if data:
+                self.parser.feed(data)
+            elif deadline is not None and monotonic() >= deadline:
+                raise TimeoutError('No complete message received from gimbal')
+
+    def decode(self, message: Message) -> Any:
+        """
+        Decode a message and keep IMU angles from realtime data in history,
+        timestamped with the estimated moment the frame started to arrive.
+        """
+        payload = decode_message(message, self.custom_layout)
+        angles = getattr(payload, 'imu_angle', None)
+        if angles is not None:
+            baudrate = getattr(self, 'baudrate', None)
+            transfer = (message.payload_size + 6) * 10 / baudrate if baudrate else 0.0
+            self.history.add(monotonic() - transfer, angles)
+        return payload
 
     def read_message(self) -> Any:
-        header_data = self.read(4)
-        header = Message.unpack_header(header_data)
-        payload_data = self.read(header.payload_size + 2)
-        message = header.unpack_payload(payload_data)
-        msg_type = payloads_map.get(message.command_id, None)
-        if msg_type is not None:
-            command_id, payload_format, _ = msg_type.format()
-            payload = unpack(payload_format, message.payload)
-            payload = deserialize(msg_type, list(payload))
-            return payload
-        if message.command_id == 67:    # CMD_CONFIRM
-            fmt = f'<B{message.payload_size - 1}s'
-            return Confirm(*unpack(fmt, message.payload))
-        raise RuntimeError(f'Unknown response command_id {message.command_id}')
+        return self.decode(self.read_frame())
 
     def write_message(self, payload):
-        command_id, fmt, _ = payload.format()
-        self.write(Message.create(command_id, pack(fmt, *payload)).pack())
+        with self.write_lock:
+            if isinstance(payload, int):
+                frame = self.encoder.encode(payload)
+            else:
+                command_id, fmt, _ = payload.format()
+                frame = self.encoder.encode_struct(command_id, compiled_struct(fmt), *payload)
+            self.write(frame)
+            if self.recorder is not None:
+                self.recorder.sent(frame)
+
+    def expect(self, key) -> Future:
+        future = Future()
+        future.set_running_or_notify_cancel()
+        return self.router.expect(key, future)
 
-    def request(self, req):
+    def wait(self, future: Future, key, timeout: Optional[float] = None) -> Any:
+        """
+        Result of a future from expect(). Without the background reader the
+        messages are read on this thread until it is done, see poll().
+        """
+        timeout = self.timeout if timeout is None else timeout
+        if self.reader_thread is None:
+            return self.poll(future, key, timeout)
+        try:
+            return future.result(timeout)
+        except FutureTimeoutError:
+            self.router.discard(key, future)
+            raise TimeoutError(f'No response {key} received from gimbal')
+
+    def poll(self, future: Future, key, timeout: Optional[float] = None) -> Any:
+        """
+        Read and route messages on this thread until future is done, so
+        stream frames and other replies in between go where they belong.
+        """
+        deadline = None if timeout is None else monotonic() + timeout
+        try:
+            while not future.done():
+                if deadline is not None and monotonic() >= deadline:
+                    raise TimeoutError(f'No response {key} received from gimbal')
+                self.router.route(self.read_frame(), self.decode)
+        except BaseException:
+            self.router.discard(key, future)
+            raise
+        return future.result()
+
+    def request_async(self, req: Union[int, NamedTuple], key=None) -> Future:
+        """
+        Send a request and return a future of its response. Requires the
+        background reader, see start_reader().
+        """
+        if self.reader_thread is None:
+            raise RuntimeError('Background reader is not started')
+        future = self.expect(request_key(req) if key is None else key)
         self.write_message(req)
-        return self.read_message()
+        return future
+
+    def request(self, req: Union[int, NamedTuple], key=None):
+        key = request_key(req) if key is None else key
+        future = self.expect(key)
+        try:
+            self.write_message(req)
+        except BaseException:
+            self.router.discard(key, future)
+            raise
+        return self.wait(future, key)
 
     def board_info(self, cfg: int = 0) -> BoardInfo:
         return self.request(BoardInfoReq(cfg))
 
     def motors_on(self) -> bool:
-        self.write(Message.create(77).pack())
-        result = self.read_message()
+        result = self.request(CMD_MOTORS_ON)
         assert isinstance(result, Confirm)
-        assert result.cmd_id == 77
+        assert result.cmd_id == CMD_MOTORS_ON
         return True
 
     def motors_off(self, mode=0) -> bool:
         result = self.request(MotorsOffReq(mode))
         assert isinstance(result, Confirm)
-        assert result.cmd_id == 109
+        assert result.cmd_id == CMD_MOTORS_OFF
         return True
 
     def control_angle(self, roll: float, pitch: float, yaw: float, auto=True):
-        mode = 2  # MODE_ANGLE
-        if auto:
-            mode |= 1 << 6
-        self.write_message(ControlReq(
-            mode, mode, mode,
-            0, round(roll / 0.02197265625),
-            0, round(pitch / 0.02197265625),
-            0, round(yaw / 0.02197265625),
-        ))
-        result = self.read_message()
+        req = ControlReq.angles(roll, pitch, yaw, auto)
+        done_key = CMD_CONFIRM, CMD_CONTROL, b'\x01'
+        done = self.expect(done_key) if auto else None
+        try:
+            result = self.request(req)
+        except BaseException:
+            if done is not None:
+                self.router.discard(done_key, done)
+            raise
         assert isinstance(result, Confirm)
-        assert result.cmd_id == 67
-        while auto and len(result.data) == 0:
-            result = self.read_message()
-            assert isinstance(result, Confirm)
-            assert result.cmd_id == 67
-            if result.data == b'\x01':
-                return True
-        return False
+        assert result.cmd_id == CMD_CONTROL
+        if done is None:
+            return False
+        self.wait(done, done_key)
+        return True
 
     def realtime_data(self, ver=3):
-        self.write(Message.create(23 if ver == 3 else 25).pack())
-        return self.read_message()
+        command_id = CMD_REALTIME_DATA_3 if ver == 3 else CMD_REALTIME_DATA_4
+        return self.request(command_id, key=command_id)
+
+    def wait_settled(self, target: Optional[Angles] = None, angle_tolerance: float = 0.2,
+                     rate_tolerance: float = 1.0, samples: int = 2, timeout: Optional[float] = None) -> RealtimeData3:
+        """
+        Poll realtime data until is_settled() holds for the given number of
+        consecutive samples and return the last one.
+        """
+        timeout = self.timeout if timeout is None else timeout
+        deadline = None if timeout is None else monotonic() + timeout
+        count = 0
+        while True:
+            data = self.realtime_data()
+            count = count + 1 if is_settled(data, target, angle_tolerance, rate_tolerance) else 0
+            if count >= samples:
+                return data
+            if deadline is not None and monotonic() >= deadline:
+                raise TimeoutError(f'Gimbal did not settle at {target or data.target_angle}, now at {data.imu_angle}')
+
+    def move_to(self, roll: float, pitch: float, yaw: float, **settle) -> RealtimeData3:
+        """
+        Move to the given angles and return as soon as the gimbal settled
+        there, see wait_settled() for the tolerances.
+        """
+        self.control_angle(roll, pitch, yaw, auto=False)
+        return self.wait_settled(Angles(roll, pitch, yaw), **settle)
+
+    def run_sequence(self, poses: Iterable[Tuple[float, float, float]],
+                     action: Callable[[Tuple[float, float, float], RealtimeData3], Any], **settle) -> List[Any]:
+        """
+        Visit every (roll, pitch, yaw) pose and call action(pose, data) once
+        the gimbal settled there. Returns the results of action.
+        """
+        return [action(pose, self.move_to(*pose, **settle)) for pose in poses]
+
+    def realtime_data_custom(self, flags: int = REALTIME_CUSTOM_IMU_ANGLES) -> RealtimeDataCustom:
+        self.custom_layout = RealtimeCustomLayout(flags)
+        return self.request(RealtimeDataCustomReq(flags))
+
+    def start_stream(self, command_id: int = CMD_REALTIME_DATA_3, interval_ms: int = 10, flags: int = 0) -> bool:
+        """
+        Make the controller send command_id every interval_ms on its own.
+        For CMD_REALTIME_DATA_CUSTOM, flags select the REALTIME_CUSTOM_* fields.
+        """
+        config = bytes(8)
+        if command_id == CMD_REALTIME_DATA_CUSTOM:
+            self.custom_layout = RealtimeCustomLayout(flags)
+            config = pack('<I4x', flags)
+        result = self.request(DataStreamIntervalReq(command_id, interval_ms, config))
+        assert isinstance(result, Confirm)
+        return True
+
+    def stop_stream(self, command_id: int = CMD_REALTIME_DATA_3) -> bool:
+        result = self.request(DataStreamIntervalReq(command_id, 0))
+        assert isinstance(result, Confirm)
+        return True
+
+    def subscribe(self, callback: Callable[[Any], None], command_id: int = CMD_REALTIME_DATA_3,
+                  interval_ms: int = 10, flags: int = 0) -> Callable[[], None]:
+        """
+        Start a data stream and pass every decoded frame of it to callback on
+        the reader thread. Returns a function that cancels the subscription.
+        """
+        def listener(payload):
+            if response_key(payload) == command_id:
+                callback(payload)
+
+        self.start_reader()
+        self.router.add_listener(listener)
+        try:
+            self.start_stream(command_id, interval_ms, flags)
+        except BaseException:
+            self.router.remove_listener(listener)
+            raise
+
+        def unsubscribe():
+            self.router.remove_listener(listener)
+            self.stop_stream(command_id)
+        return unsubscribe
+
+    def stream(self, command_id: int = CMD_REALTIME_DATA_3, interval_ms: int = 10, flags: int = 0) -> Iterator[Any]:
+        """
+        Generator of decoded stream frames; the stream is stopped when the
+        generator is closed.
+        """
+        if self.reader_thread is not None:
+            frames = Queue()
+            unsubscribe = self.subscribe(frames.put, command_id, interval_ms, flags)
+            try:
+                while True:
+                    try:
+                        yield frames.get(timeout=self.timeout)
+                    except Empty:
+                        raise TimeoutError(f'No {command_id} stream data received from gimbal')
+            finally:
+                unsubscribe()
+        else:
+            self.start_stream(command_id, interval_ms, flags)
+            try:
+                while True:
+                    payload = self.read_message()
+                    if response_key(payload) == command_id:
+                        yield payload
+                    else:
+                        self.router.dispatch(payload)
+            finally:
+                self.stop_stream(command_id)
+
+
+class Gimbal(GimbalBase, Serial):
+    """
+    SimpleBGC gimbal controller on a serial port, e.g.
+    Gimbal('/dev/ttyUSB0', baudrate=115200, timeout=10)
+    """
 
 
 if __name__ == '__main__':
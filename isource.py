@@ -1,19 +1,64 @@
-from typing import NamedTuple, List, Any, Optional, Union
+from typing import NamedTuple, Dict, List, Any, Optional, Tuple, Union
 from datetime import timedelta
-from threading import Lock
-from time import sleep
-import cv2
+from threading import Lock, Thread
+from time import sleep, monotonic, perf_counter, time
 import numpy as np
+import json
+import re
 import sys
-import gi
+import os
 
-gi.require_version("Tcam", "0.1")
-gi.require_version("GLib", "2.0")
-gi.require_version("Gst", "1.0")
-gi.require_version("GstVideo", "1.0")
-gi.require_version("GstRtspServer", "1.0")
+from frames import FrameRef, FrameRing, FrameStats
 
-from gi.repository import Tcam, Gst, GstVideo, GstRtspServer, GLib, GObject
+_gi_lock = Lock()
+
+
+def init_gstreamer():
+    """
+    Load the GObject bindings and initialize GStreamer. Done on first use
+    rather than on import, which takes a noticeable part of a short run.
+    """
+    if isinstance(Gst, _Lazy):
+        with _gi_lock:
+            if isinstance(Gst, _Lazy):
+                import gi
+                try:
+                    gi.require_version("Tcam", "0.1")
+                    # loading the typelib gives tcambin its get_tcam_property() and friends
+                    from gi.repository import Tcam  # noqa: F401
+                except (ValueError, ImportError):
+                    pass  # no tiscamera, other sources still work
+                gi.require_version("GLib", "2.0")
+                gi.require_version("Gst", "1.0")
+                gi.require_version("GstVideo", "1.0")
+                gi.require_version("GstRtspServer", "1.0")
+                from gi.repository import Gst as gst, GstVideo as gst_video, GstRtspServer as rtsp_server, GLib as glib
+                gst.init(sys.argv)  # init gstreamer
+                # from now on the module uses the real modules directly
+                globals().update(Gst=gst, GstVideo=gst_video, GstRtspServer=rtsp_server, GLib=glib)
+
+
+class _Lazy:
+    """
+    Stands for a gi.repository module until init_gstreamer() replaces it.
+    """
+    def __init__(self, name: str):
+        self.name = name
+
+    def __getattr__(self, attr):
+        init_gstreamer()
+        value = getattr(globals()[self.name], attr)
+        setattr(self, attr, value)  # for modules that imported the stand-in
+        return value
+
+
+Gst = _Lazy('Gst')
+GstVideo = _Lazy('GstVideo')
+GstRtspServer = _Lazy('GstRtspServer')
+GLib = _Lazy('GLib')
+
+DEVICE_CACHE = os.path.join(os.path.expanduser('~'), '.cache', 'isource-devices.json')
+DEVICE_CACHE_TTL = 30.0  # seconds
 
 
 class DeviceInfo(NamedTuple):
@@ -23,6 +68,188 @@ class DeviceInfo(NamedTuple):
     type: str
 
 
+class Frame(NamedTuple):
+    image: np.ndarray
+    timestamp: float  # capture time on the time.monotonic() scale
+    seq: int
+
+
+# GStreamer format: (sample type, channels) for single plane formats mapped as views
+PACKED_FORMATS = {
+    'BGRx': ('u1', 4), 'BGRA': ('u1', 4), 'RGBx': ('u1', 4), 'RGBA': ('u1', 4),
+    'xBGR': ('u1', 4), 'ABGR': ('u1', 4), 'xRGB': ('u1', 4), 'ARGB': ('u1', 4),
+    'BGR': ('u1', 3), 'RGB': ('u1', 3),
+    'GRAY8': ('u1', 1), 'GRAY16_LE': ('<u2', 1), 'GRAY16_BE': ('>u2', 1),
+}
+
+# Bayer patterns are named after the first 2x2 block in GStreamer and after the
+# second one in OpenCV
+# (OpenCV colour conversion codes by name, OpenCV is imported on first conversion)
+BAYER_FORMATS = {
+    'rggb': 'COLOR_BayerBG2BGR', 'bggr': 'COLOR_BayerRG2BGR',
+    'grbg': 'COLOR_BayerGB2BGR', 'gbrg': 'COLOR_BayerGR2BGR',
+}
+
+BGR_CONVERSIONS = {
+    'BGRx': 'COLOR_BGRA2BGR', 'BGRA': 'COLOR_BGRA2BGR', 'RGBx': 'COLOR_RGBA2BGR', 'RGBA': 'COLOR_RGBA2BGR',
+    'RGB': 'COLOR_RGB2BGR', 'GRAY8': 'COLOR_GRAY2BGR', 'GRAY16_LE': 'COLOR_GRAY2BGR',
+    'GRAY16_BE': 'COLOR_GRAY2BGR',
+}
+
+# formats with the padding or alpha byte first, converted as the three colour bytes after it
+LEADING_ALPHA = {'xBGR': 'BGR', 'ABGR': 'BGR', 'xRGB': 'RGB', 'ARGB': 'RGB'}
+
+
+class FrameFormat(NamedTuple):
+    """
+    Layout of a mapped video buffer as a NumPy view: row stride and offset
+    from the negotiated caps, so padded rows need no copy.
+    """
+    name: str
+    width: int
+    height: int
+    shape: Tuple[int, ...]
+    strides: Tuple[int, ...]
+    dtype: np.dtype
+    offset: int = 0
+
+    @staticmethod
+    def from_caps(caps) -> 'FrameFormat':
+        structure = caps.get_structure(0)
+        name = structure.get_value('format')
+        if structure.get_name() == 'video/x-bayer':
+            width, height = structure.get_value('width'), structure.get_value('height')
+            size = 2 if name.endswith('16') else 1
+            stride = (width * size + 3) & ~3
+            return FrameFormat(name, width, height, (height, width), (stride, size), np.dtype(f'<u{size}'))
+
+        video_info = GstVideo.VideoInfo()
+        video_info.from_caps(caps)
+        width, height = video_info.width, video_info.height
+        name = video_info.finfo.name
+        packed = PACKED_FORMATS.get(name)
+        if packed is None:
+            # planar and other layouts: the whole buffer as bytes
+            return FrameFormat(name, width, height, (video_info.size,), (1,), np.dtype('u1'))
+        dtype, channels = np.dtype(packed[0]), packed[1]
+        stride, offset = video_info.stride[0], video_info.offset[0]
+        if channels == 1:
+            return FrameFormat(name, width, height, (height, width), (stride, dtype.itemsize), dtype, offset)
+        return FrameFormat(name, width, height, (height, width, channels),
+                           (stride, channels * dtype.itemsize, dtype.itemsize), dtype, offset)
+
+    def view(self, data) -> np.ndarray:
+        """
+        Zero-copy view of a mapped buffer.
+        """
+        return np.ndarray(self.shape, self.dtype, data, self.offset, self.strides)
+
+    def to_bgr(self, image: np.ndarray) -> np.ndarray:
+        """
+        Convert an image of this format to 8 or 16 bit BGR, e.g. for saving or display.
+        """
+        name = self.name
+        if name in LEADING_ALPHA:
+            name, image = LEADING_ALPHA[name], np.ascontiguousarray(image[..., 1:])
+        if name == 'BGR':
+            return image
+        code = BAYER_FORMATS.get(name[:4], BGR_CONVERSIONS.get(name))
+        if code is None:
+            raise ValueError(f'No conversion from {self.name} to BGR')
+        import cv2
+        if not image.dtype.isnative:
+            image = image.astype(image.dtype.newbyteorder('='))
+        return cv2.cvtColor(image, getattr(cv2, code))
+
+
+class VideoMode(NamedTuple):
+    media: str  # video/x-raw or video/x-bayer
+    format: str
+    width: int  # the smallest size if the camera accepts a range
+    height: int
+    max_width: int
+    max_height: int
+    framerates: Tuple[float, ...]  # listed rates, empty if any in [min_fps, max_fps]
+    min_fps: float
+    max_fps: float
+    width_step: int = 1  # sizes in a range go up from width and height in these steps
+    height_step: int = 1
+
+
+# structure strings end in ';', which must not stick to a single last value
+_CAPS_FIELD = re.compile(r'([\w-]+)=\((\w+)\)(\{[^}]*\}|\[[^\]]*\]|[^,;]+)')
+
+
+def _caps_value(kind: str, text: str):
+    text = text.strip()
+    if kind == 'fraction':
+        num, _, den = text.partition('/')
+        return int(num) / int(den or 1)
+    return int(text) if kind == 'int' else text.strip('"')
+
+
+def parse_modes(structure: str) -> List[VideoMode]:
+    """
+    Modes of a caps structure string, one per listed format. Parsing the
+    string works with every version of the Python bindings, unlike
+    reading range and list values.
+    """
+    media = structure.split(',', 1)[0].strip().rstrip(';')
+    fields = {}
+    for name, kind, value in _CAPS_FIELD.findall(structure):
+        if value[0] in '{[':
+            items = tuple(_caps_value(kind, item) for item in value[1:-1].split(',') if item.strip())
+            fields[name] = ('range' if value[0] == '[' else 'list'), items
+        else:
+            fields[name] = 'value', (_caps_value(kind, value),)
+
+    def bounds(name: str) -> Tuple[Any, Any, Any]:
+        kind, items = fields.get(name, ('value', (0,)))
+        if kind == 'range':  # [min, max] or [min, max, step]
+            return items[0], items[1], items[2] if len(items) > 2 else 1
+        return min(items), max(items), 1
+
+    width, max_width, width_step = bounds('width')
+    height, max_height, height_step = bounds('height')
+    kind, rates = fields.get('framerate', ('list', ()))
+    framerates = tuple(sorted(rates, reverse=True)) if kind != 'range' else ()
+    min_fps, max_fps = bounds('framerate')[:2] if rates else (0.0, 0.0)
+    _, formats = fields.get('format', ('value', ('',)))
+    return [VideoMode(media, fmt, width, height, max_width, max_height, framerates, min_fps, max_fps,
+                      width_step, height_step)
+            for fmt in formats]
+
+
+def format_bytes(fmt: str) -> Optional[float]:
+    """
+    Bytes per pixel of a format that maps to an image without conversion, else None.
+    """
+    if fmt[:4] in BAYER_FORMATS:
+        return 2 if fmt.endswith('16') else 1
+    packed = PACKED_FORMATS.get(fmt)
+    return np.dtype(packed[0]).itemsize * packed[1] if packed else None
+
+
+def mode_size(mode: VideoMode, width: int, height: int) -> Optional[Tuple[int, int]]:
+    """
+    The smallest size of mode that is at least width x height, None if too small.
+    """
+    def fit(low: int, high: int, step: int, size: int) -> Optional[int]:
+        if size <= low:
+            return low
+        size = low + -(-(size - low) // max(step, 1)) * max(step, 1)
+        return size if size <= high else None
+
+    size = fit(mode.width, mode.max_width, mode.width_step, width), fit(mode.height, mode.max_height, mode.height_step, height)
+    return None if None in size else size
+
+
+def mode_has_fps(mode: VideoMode, fps: float) -> bool:
+    if mode.framerates:
+        return any(abs(rate - fps) < 0.01 for rate in mode.framerates)
+    return mode.min_fps - 0.01 <= fps <= mode.max_fps + 0.01
+
+
 class PropertyInfo(NamedTuple):
     value: Any
     min_value: Any
@@ -38,9 +265,6 @@ class PropertyInfo(NamedTuple):
 framecount = 0
 
 
-Gst.init(sys.argv)  # init gstreamer
-
-
 class GstBuilder:
     def __init__(self, *pipeline: str):
         self.pipeline = ' ! '.join(pipeline)
@@ -74,6 +298,34 @@ class GstBuilder:
             f'splitmuxsink location={file_mask} max-size-time={int(max_size.total_seconds() * 1e9)} muxer=mp4mux'
         )
 
+    def output(self, name: str, width: Optional[int] = None, height: Optional[int] = None,
+               fps: Optional[int] = None, crop: Optional[Tuple[int, int, int, int]] = None,
+               fmt: Optional[str] = None, debayer=False):
+        """
+        Extra appsink branch named name, rate limited to fps, cropped by
+        crop = (left, top, right, bottom) pixels, scaled to width x height and
+        converted to fmt, all inside the pipeline. The leaky queue and the
+        dropping appsink keep a slow consumer from holding up the camera.
+        Bayer input needs debayer=True to be scaled.
+        """
+        elements = ['queue leaky=downstream max-size-buffers=1']
+        if fps:
+            elements.append(f'videorate max-rate={fps} drop-only=true')
+        if crop:
+            left, top, right, bottom = crop
+            elements.append(f'videocrop left={left} top={top} right={right} bottom={bottom}')
+        if debayer:
+            elements.append('bayer2rgb')
+        if width or height:
+            elements.append('videoscale')
+        if fmt or debayer:
+            elements.append('videoconvert')
+        caps = [f'{key}={value}' for key, value in (('format', fmt), ('width', width), ('height', height)) if value]
+        if caps:
+            elements.append(','.join(['video/x-raw'] + caps))
+        elements.append(f'appsink name={name} max-buffers=1 drop=true sync=false')
+        return self.branch(*elements)
+
     def encode(self, encoder='omxh265enc', **params):
         encoder += ' ' + ' '.join(f'{k}={v}' for k, v in params.items())
         return self.branch('videoconvert', encoder)
@@ -85,133 +337,427 @@ class GstBuilder:
         return Gst.parse_launch(string)
 
 
-class Factory(GstRtspServer.RTSPMediaFactory):
-    def __init__(self):
-        super(Factory, self).__init__()
-
-    def create_element(self, url):
-        print('Create element!!!', url)
-        raise RuntimeError('Test')
-
-
-def make_server(launch: str, port: int = 8554, url: str = '/test'):
-    # GObject.type_register(Factory)
-
-    # loop = GLib.MainLoop()
-    rtsp = GstRtspServer.RTSPServer()
-    rtsp.set_service(str(port))
-    #g_object_set(server, "service", port, NULL);
-    mp = rtsp.get_mount_points()
-    factory = GstRtspServer.RTSPMediaFactory()
-    factory.set_launch(launch)
-    # str(GstBuilder(
-    #     'tcambin name=source',
-    #     '\'video/x-raw,format=RGBx,width=1280,height=720,framerate=(fraction)60/1\''
-    #     #'capsfilter name=filter',
-    #     'videoconvert',
-    #     '\'video/x-raw,format=I420\'',
-    #     'videoconvert',
-    #     'x264enc qp-min=18 speed-preset=superfast ! h264parse ! rtph264pay  name=pay0 pt=96 config-interval=1'
-    # )))
-    factory.set_shared(True)
-    # mf = factory.g_type_instance
-    mp.add_factory(url, factory)
-    mp = None
-    rtsp.attach(None)
-    media = factory.construct(url)
-    media.set_reusable(True)
-    return media.pipeline
-    # loop.run()
-
-
-class NumProperty:
+def codec_elements(encoder: str) -> Tuple[str, str]:
+    """
+    Parser and RTP payloader for the output of an encoder element.
+    """
+    if '265' in encoder or 'hevc' in encoder:
+        return 'h265parse', 'rtph265pay'
+    return 'h264parse', 'rtph264pay'
+
+
+class RtspFanout:
+    """
+    Serves the already encoded stream from an appsink of the capture
+    pipeline over RTSP. The media factory is shared, so there is one appsrc
+    and payloader for all clients and each extra viewer costs only network
+    sends, not another encode. The server runs its own GLib main loop.
+
+        src = ISource(source='videotestsrc is-live=true', serve={'port': 8554},
+                      encode={'encoder': 'x264enc', 'tune': 'zerolatency'})
+        # gst-launch-1.0 rtspsrc location=rtsp://127.0.0.1:8554/test ! decodebin ! autovideosink
+    """
+    def __init__(self, sink: 'Gst.Element', payloader: str = 'rtph264pay', port: int = 8554, url: str = '/test'):
+        self.sink = sink
+        self.lock = Lock()
+        self.sources = {}  # appsrc: (PTS offset or None until its first keyframe, waiting for a keyframe)
+
+        self.context = GLib.MainContext()
+        self.loop = GLib.MainLoop(self.context)
+        self.server = GstRtspServer.RTSPServer()
+        self.server.set_service(str(port))
+        factory = GstRtspServer.RTSPMediaFactory()
+        factory.set_launch(f'( appsrc name=encoded is-live=true format=time ! {payloader} name=pay0 pt=96 config-interval=1 )')
+        factory.set_shared(True)
+        factory.connect('media-configure', self._configure)
+        self.server.get_mount_points().add_factory(url, factory)
+        self.server.attach(self.context)
+        self.url = f'rtsp://127.0.0.1:{port}{url}'
+
+        sink.set_property('emit-signals', True)
+        sink.connect('new-sample', self._sample)
+        self.thread = Thread(target=self.loop.run, name='rtsp-server', daemon=True)
+        self.thread.start()
+
+    def _configure(self, factory, media):
+        appsrc = media.get_element().get_child_by_name('encoded')
+        caps = self.sink.get_static_pad('sink').get_current_caps()
+        if caps is not None:
+            appsrc.set_property('caps', caps)
+        with self.lock:
+            self.sources[appsrc] = None, True
+        media.connect('unprepared', lambda _: self._remove(appsrc))
+        # new viewers should not wait a whole GOP for a picture
+        self._request_keyframe()
+
+    def _request_keyframe(self):
+        # an upstream event, the sink element passes it on from its sink pad towards the encoder
+        self.sink.send_event(GstVideo.video_event_new_upstream_force_key_unit(Gst.CLOCK_TIME_NONE, True, 0))
+
+    def _remove(self, appsrc):
+        with self.lock:
+            self.sources.pop(appsrc, None)
+
+    def _set_source(self, appsrc, offset, waiting: bool):
+        with self.lock:
+            if appsrc in self.sources:
+                self.sources[appsrc] = offset, waiting
+
+    def _sample(self, sink):
+        sample = sink.emit('pull-sample')
+        if not sample:
+            return Gst.FlowReturn.OK
+        buffer = sample.get_buffer()
+        with self.lock:
+            sources = list(self.sources.items())
+        for appsrc, (offset, waiting) in sources:
+            if waiting:
+                if buffer.has_flags(Gst.BufferFlags.DELTA_UNIT):
+                    continue
+                if offset is None:
+                    appsrc.set_property('caps', sample.get_caps())
+                    offset = buffer.dts if buffer.dts != Gst.CLOCK_TIME_NONE else buffer.pts
+                self._set_source(appsrc, offset, False)
+            elif 0 < appsrc.get_property('max-bytes') <= appsrc.get_property('current-level-bytes'):
+                # a viewer that can not keep up skips to the next keyframe: a dropped delta
+                # frame would corrupt its picture until then anyway
+                self._set_source(appsrc, offset, True)
+                self._request_keyframe()
+                continue
+            # the copy shares the encoded memory, only the timestamps move to the media's running time
+            out = buffer.copy()
+            if out.pts != Gst.CLOCK_TIME_NONE:
+                out.pts = max(0, out.pts - offset)
+            if out.dts != Gst.CLOCK_TIME_NONE:
+                out.dts = max(0, out.dts - offset)
+            appsrc.emit('push-buffer', out)
+        return Gst.FlowReturn.OK
+
+    def close(self):
+        self.loop.quit()
+        self.thread.join()
+
+
+class Property:
+    """
+    A camera property with its last known value cached, so reading it costs
+    nothing and writing the current value again is skipped.
+    """
     def __init__(self, name, camera, info: PropertyInfo):
         self.name = name
         self.camera = camera
         self.info = info
+        self.value = info.value
 
+    def check(self, value):
+        return value
 
-class EnumProperty:
+    def set(self, value, force=False) -> bool:
+        """
+        Write value to the camera unless it is already set. Returns True if written.
+        """
+        value = self.check(value)
+        if value == self.value and not force:
+            return False
+        self.camera.set_tcam_property(self.name, value)
+        self.value = value
+        return True
+
+    def refresh(self):
+        ret, value, *_ = self.camera.get_tcam_property(self.name)
+        if ret:
+            self.value = value
+        return self.value
+
+
+class NumProperty(Property):
+    def check(self, value):
+        info = self.info
+        if info.type == 'integer':
+            value = int(round(value))
+        if not info.min_value <= value <= info.max_value:
+            raise ValueError(f'{self.name}: {value} is out of range [{info.min_value}, {info.max_value}]')
+        return value
+
+
+class EnumProperty(Property):
     def __init__(self, name, camera, info: PropertyInfo):
-        self.name = name
-        self.camera = camera
-        ...
+        super().__init__(name, camera, info)
+        self.entries: Optional[List[str]] = None
+
+    def check(self, value):
+        if self.entries is None:
+            self.entries = list(self.camera.get_tcam_menu_entries(self.name))
+        if value not in self.entries:
+            raise ValueError(f'{self.name}: {value!r} is not one of {self.entries}')
+        return value
 
 
 prop_types = {
+    'boolean': Property,
     'integer': NumProperty,
     'double': NumProperty,
     'enum': EnumProperty,
 }
 
 
-class ISource:
+class CameraProperties:
+    """
+    Properties of a tcam source, read from the camera on first use only.
+
+        src.properties['Exposure'].value
+        src.properties.set('Zoom', 3)
+        src.properties.apply_profile({'Exposure Auto': False, 'Exposure': 3000})
+    """
+    def __init__(self, camera):
+        self.camera = camera
+        self.cache = {}
+        self.names: Optional[List[str]] = None
+
+    def __iter__(self):
+        if self.names is None:
+            getter = getattr(self.camera, 'get_tcam_property_names', None)
+            self.names = list(getter()) if getter else []
+        return iter(self.names)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.cache or name in iter(self)
+
+    def __getitem__(self, name: str) -> Property:
+        prop = self.cache.get(name)
+        if prop is None:
+            params = list(self.camera.get_tcam_property(name))
+            if not params.pop(0):
+                raise KeyError(f'Could not receive property {name}')
+            info = PropertyInfo(*params)
+            prop_type = prop_types.get(info.type)
+            if prop_type is None:
+                raise KeyError(f'Property {name}: unknown type: {info.type}')
+            prop = self.cache[name] = prop_type(name, self.camera, info)
+        return prop
+
+    def get(self, name: str, refresh=False):
+        prop = self[name]
+        return prop.refresh() if refresh else prop.value
+
+    def set(self, name: str, value) -> bool:
+        # while the camera controls a value itself the cache is stale, so always write
+        auto_name = f'{name} Auto'
+        force = auto_name in self and bool(self[auto_name].value)
+        written = self[name].set(value, force=force)
+        if written and name.endswith(' Auto'):
+            # switching automatic control leaves the controlled value wherever the camera had it
+            self.cache.pop(name[:-len(' Auto')], None)
+        return written
+
+    def apply_profile(self, profile: Dict[str, Any]) -> List[str]:
+        """
+        Set several properties in the given order, e.g. "Exposure Auto"
+        before "Exposure". All values are checked before anything is written.
+        Returns the names of the properties actually written.
+        """
+        for name, value in profile.items():
+            self[name].check(value)
+        return [name for name, value in profile.items() if self.set(name, value)]
+
+    def invalidate(self):
+        """
+        Forget cached values, e.g. after the device was reopened.
+        """
+        self.cache.clear()
+        self.names = None
+
+
+class FrameOutput:
+    """
+    Reading side of an appsink: frames arrive in ring through ISource.callback.
+    """
+    def __init__(self, buffers: int):
+        self.ring = FrameRing(buffers)
+        self.caps = None
+        self.format: Optional[FrameFormat] = None
+        self.metrics = None
+
+    def checkout(self, after: int = 0) -> Optional[FrameRef]:
+        """
+        Latest frame without copying, newer than sequence number after;
+        release it (or use with) when done.
+        """
+        return self.ring.checkout(after)
+
+    def read_next(self, timeout: Optional[float] = None) -> Optional[FrameRef]:
+        """
+        Wait for the next frame to arrive and check it out, None on timeout.
+        """
+        return self.ring.wait(timeout=timeout)
+
+    def read_after(self, timestamp: float, timeout: Optional[float] = None) -> Optional[FrameRef]:
+        """
+        Wait for a frame captured at or after timestamp (time.monotonic() scale)
+        and check it out, None on timeout. Returns at once if the latest frame
+        is recent enough.
+        """
+        return self.ring.wait(0, timestamp, timeout)
+
+    def read(self):
+        frame = self.ring.checkout()
+        if frame is None:
+            return None
+        with frame:
+            return frame.image.copy()
+
+    def read_frame(self) -> Optional[Frame]:
+        frame = self.ring.checkout()
+        if frame is None:
+            return None
+        with frame:
+            return Frame(frame.image.copy(), frame.timestamp, frame.seq)
+
+    def stats(self) -> FrameStats:
+        return self.ring.stats()
+
+
+class ScaledOutput(FrameOutput):
+    """
+    An extra appsink branch of an ISource added by GstBuilder.output(),
+    e.g. a small or cropped stream for analysis, with its own frame ring.
+    """
+    def __init__(self, source: 'ISource', name: str, buffers: int = 2):
+        super().__init__(buffers)
+        self.source = source
+        self.name = name
+
+    def capture_time(self, sample) -> float:
+        return self.source.capture_time(sample)
+
+
+class ISource(FrameOutput):
+    devices: Optional[Tuple[float, List[DeviceInfo]]] = None
+
     @staticmethod
-    def list_devices(print_list=True) -> List[DeviceInfo]:
+    def list_devices(print_list=True, max_age: float = DEVICE_CACHE_TTL) -> List[DeviceInfo]:
         """
-        Print information about all available devices
+        Print information about all available devices. A list found less than
+        max_age seconds ago, in this or another process, is reused;
+        max_age=0 forces discovery.
         """
+        result = ISource.cached_devices(max_age)
+        if result is None:
+            result = ISource.discover_devices()
+        if not result:
+            print('No cameras found!')
+        elif print_list:
+            for device in result:
+                print(f'Model: {device.model} Serial: {device.serial} Type: {device.type}')
+        return result
+
+    @staticmethod
+    def cached_devices(max_age: float) -> Optional[List[DeviceInfo]]:
+        if ISource.devices is not None and monotonic() - ISource.devices[0] <= max_age:
+            return ISource.devices[1]
+        try:
+            with open(DEVICE_CACHE) as file:
+                cache = json.load(file)
+            if time() - cache['time'] > max_age:
+                return None
+            result = [DeviceInfo(*device) for device in cache['devices']]
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+        ISource.devices = monotonic(), result
+        return result
+
+    @staticmethod
+    def discover_devices() -> List[DeviceInfo]:
         result = []
         source = Gst.ElementFactory.make("tcambin")
-        serials = source.get_device_serials()
-        if serials:
-            for serial in serials:
-                flag, model, identifier, connection_type = source.get_device_info(serial)
-                if flag:
-                    result.append(DeviceInfo(model, serial, identifier, connection_type))
-                    if print_list:
-                        print(f'Model: {model} Serial: {serial} Type: {connection_type}')
-        else:
-            print('No cameras found!')
+        serials = source.get_device_serials() if source is not None else None
+        for serial in serials or []:
+            flag, model, identifier, connection_type = source.get_device_info(serial)
+            if flag:
+                result.append(DeviceInfo(model, serial, identifier, connection_type))
+        if result:  # an empty list is not cached, a camera may show up any moment
+            ISource.devices = monotonic(), result
+            try:
+                os.makedirs(os.path.dirname(DEVICE_CACHE), exist_ok=True)
+                with open(DEVICE_CACHE, 'w') as file:
+                    json.dump({'time': time(), 'devices': result}, file)
+            except OSError:
+                pass
         return result
 
-    def __init__(self, serial=None, file_mask=None, encode=None, serve=None):
+    @staticmethod
+    def forget_devices():
+        """
+        Drop the cached device list, e.g. after plugging a camera in or out.
+        """
+        ISource.devices = None
+        try:
+            os.remove(DEVICE_CACHE)
+        except OSError:
+            pass
+
+    def __init__(self, serial=None, file_mask=None, encode=None, serve=None, source='tcambin', buffers=4,
+                 metrics=False, outputs: Optional[Dict[str, Dict[str, Any]]] = None):
         self.zoom = 0
         self.serial = serial
-        self.buffer = None
-        self.lock = Lock()
-        self.properties = {}
-        builder = GstBuilder('tcambin name=source', 'capsfilter name=filter')
-        if file_mask:
-            builder('queue').encode(**(encode or {})).split_write(file_mask)
-        builder('queue ! videoconvert' if file_mask else 'videoconvert', 'appsink name=sink')
-
-        if serve is None:
-            self.pipeline = builder.parse()
-        else:
-            make_server(str(builder), **serve)
+        super().__init__(buffers)
+        self.modes: Dict[bool, List[VideoMode]] = {}
+        builder = GstBuilder(f'{source} name=source', 'capsfilter name=filter')
+        if file_mask or serve is not None:
+            # encode once, then tee the bitstream to the recording and the RTSP server
+            encode = dict(encode or {})
+            parser, payloader = codec_elements(encode.get('encoder', 'omxh265enc'))
+            encoded = builder('queue').encode(**encode).branch(parser)
+            if file_mask:
+                encoded('queue').split_write(file_mask)
+            if serve is not None:
+                # no drop: losing a delta frame corrupts the picture up to the next keyframe, slow
+                # viewers are skipped to a keyframe by RtspFanout instead
+                encoded('queue', 'appsink name=encoded sync=false')
+        for name, params in (outputs or {}).items():
+            builder.output(name, **params)
+        # no videoconvert here: frames are mapped in the negotiated format and converted on demand
+        builder(*(('queue', 'appsink name=sink') if builder.branches else ('appsink name=sink',)))
+
+        self.pipeline = builder.parse()
 
         # test for error
         if not self.pipeline:
             raise RuntimeError("Could not create pipeline.")
 
+        self.server = None
+        if serve is not None:
+            self.server = RtspFanout(self.pipeline.get_by_name('encoded'), payloader, **serve)
+
+        self.outputs = {name: ScaledOutput(self, name) for name in outputs or {}}
+
+        if metrics:
+            from metrics import PipelineMetrics
+            self.metrics = PipelineMetrics(self.pipeline)
+
         self.camera = self.pipeline.get_by_name("source")
         # The user has not given a serial, so we prompt for one
         if serial is not None:
             self.camera.set_property("serial", serial)
+        self.properties = CameraProperties(self.camera)
 
-        property_names = self.camera.get_tcam_property_names()
-
-        for name in property_names:
-            params = list(self.camera.get_tcam_property(name))
-            ret = params.pop(0)
-            info = PropertyInfo(*params)
-
-            if not ret:
-                print("could not receive value {}".format(name))
-                continue
-
-            prop_type = prop_types.get(info.type, None)
-            if prop_type is None:
-                print(f'Property {name}: unknown type: {info.type}')
-                continue
-
-            prop = prop_type(name, self.camera, info)
-            self.properties[name] = prop
-
-    def set_format(self, width: int, height: int, fps: int, fmt='BGRx'):
+    def set_format(self, width: int, height: int, fps: int, fmt='BGRx') -> Optional[VideoMode]:
+        """
+        Request a mode from the camera. With fmt='auto' the native mode chosen
+        by select_mode() is used, so no colour conversion runs in the pipeline;
+        it is returned, None if there is none.
+        """
+        mode = None
+        if fmt == 'auto':
+            mode = self.select_mode(width, height, fps)
+            if mode is None:
+                print(f'No native mode for {width}x{height} at {fps} fps')
+                return None
+            fmt, width, height = mode.format, mode.width, mode.height
         caps = Gst.Caps.new_empty()
-        structure = Gst.Structure.new_from_string("video/x-raw")
+        structure = Gst.Structure.new_from_string("video/x-bayer" if fmt and fmt[:4] in BAYER_FORMATS else "video/x-raw")
+        if fmt:
+            structure.set_value("format", fmt)
         structure.set_value("width", width)
         structure.set_value("height", height)
         try:
@@ -219,7 +765,7 @@ class ISource:
             structure.set_value("framerate", fraction)
         except TypeError:
             struc_string = structure.to_string()
-            struc_string += ",framerate={}/{}".format(30, 1)
+            struc_string += ",framerate={}/{}".format(fps, 1)
             structure.free()
             structure, end = structure.from_string(struc_string)
 
@@ -228,208 +774,149 @@ class ISource:
         caps_filter = self.pipeline.get_by_name("filter")
         if not caps_filter:
             print("Could not retrieve capsfilter from pipeline.")
-            return 1
+            return None
         caps_filter.set_property("caps", caps)
+        return mode
 
-    def print_formats(self):
-        self.camera.set_state(Gst.State.READY)
-        caps = self.camera.get_static_pad("src").query_caps()
-        for x in range(caps.get_size()):
-            structure = caps.get_structure(x)
-            name = structure.get_name()
-            try:
-                fmt = structure.get_value("format")
-
-                if type(fmt) is str:
-                    print("{} {}".format(name, fmt), end="")
-                elif type(fmt) is Gst.ValueList:
-
-                    print("{} {{ ".format(name), end="")
-
-                    for y in range(Gst.ValueList.get_size(fmt)):
-                        val = Gst.ValueList.get_value(fmt, y)
-
-                        print("{} ".format(val), end="")
-                    print("}", end="")
-                else:
-                    print("==")
-            except TypeError:  # Gst.ValueList
-
-                # this means we have multiple formats that all
-                # have the same width/height/framerate settings
-
-                begin = structure.to_string().find("format=(string){")
-                substr = structure.to_string()[begin:]
-                values = substr[substr.find("{") + 1:substr.find("}")]
-
-                print("{} {{ ".format(name), end="")
-
-                for fmt in values.split(","):
-                    print("{} ".format(fmt), end="")
-
-                print("}", end="")
-                # continue
-
-            # the python gobject introspection wrapper
-            # can pose problems in older version
-            # the type Gst.IntRange
-            # may not be available and thus cause a TypeError
-            # in such a case we query the string description
-            # of the Gst.Structure and extract the framerates
-            try:
-                if structure.to_string().find("[") != -1:
-                    raise TypeError
-
-                width = structure.get_value("width")
-                height = structure.get_value("height")
-
-                print(" - {}x{} - ".format(width, height), end="")
-
-            except TypeError:
-
-                import re
-
-                # width handling
-
-                begin = structure.to_string().find("width=(int)[")
-                substr = structure.to_string()[begin:]
-                values = substr[substr.find("[") + 1:substr.find("]")]
-                v = re.findall(r'\d+', values)
-
-                # assume first entry is smaller
-                width_min = v[0]
-                width_max = v[1]
-
-                # height handling
-
-                begin = structure.to_string().find("height=(int)[")
-                substr = structure.to_string()[begin:]
-                values = substr[substr.find("[") + 1:substr.find("]")]
-                v = re.findall(r'\d+', values)
-
-                height_min = v[0]
-                height_max = v[1]
-
-                print(" - {}x{} <=> {}x{} - ".format(width_min, height_min, width_max, height_max), end="")
-
-            # the python gobject introspection wrapper
-            # can pose problems in older version
-            # the types Gst.Fraction and Gst.FractionRange
-            # may not be available and thus cause a TypeError
-            # in such a case we query the string description
-            # of the Gst.Structure and extract the framerates
-            try:
-                framerates = structure.get_value("framerate")
-            except TypeError:
-
-                import re
-
-                substr = structure.to_string()[structure.to_string().find("framerate="):]
-
-                try:
-                    # try for frame rate lists
-                    field, values, remain = re.split("{|}", substr, maxsplit=3)
-                    rates = [x.strip() for x in values.split(",")]
-                    for r in rates:
-                        print("{} ".format(r), end="")
-                except ValueError:  # we have a GstFractionRange
-
-                    values = substr[substr.find("[") + 1:substr.find("]")]
-                    v = re.findall(r'\d+', values)
-                    fps_min_num = v[0]
-                    fps_min_den = v[1]
-                    fps_max_num = v[2]
-                    fps_max_den = v[3]
-                    # framerates are fractions thus one framerate euqals two values
-                    print("{}/ {} <=> {}/{}".format(fps_min_num, fps_min_den,
-                                                    fps_max_num, fps_max_den, end=""))
-
-                # printf line break
-                print("")
-                # we are done here
+    def formats(self, native=True) -> List[VideoMode]:
+        """
+        Supported modes, one per format. With native=True only what the device
+        itself delivers, without the conversions tcambin can add. Queried once
+        per source.
+        """
+        if native not in self.modes:
+            self.camera.set_state(Gst.State.READY)
+            element = self.camera
+            if native and hasattr(element, 'get_by_name'):
+                element = element.get_by_name('tcambin-source') or element
+            caps = element.get_static_pad("src").query_caps()
+            self.modes[native] = [mode for x in range(caps.get_size())
+                                  for mode in parse_modes(caps.get_structure(x).to_string())]
+        return self.modes[native]
+
+    def select_mode(self, width: int, height: int, fps: float) -> Optional[VideoMode]:
+        """
+        The native mode of a directly mappable format that gives at least
+        width x height at fps with the least bus bandwidth.
+        """
+        best, best_rate = None, None
+        for mode in self.formats(native=True):
+            size = mode_size(mode, width, height)
+            pixel = format_bytes(mode.format)
+            if size is None or pixel is None or not mode_has_fps(mode, fps):
                 continue
-
-            if type(framerates) is Gst.ValueList:
-
-                for y in range(Gst.ValueList.get_size(framerates)):
-                    val = Gst.ValueList.get_value(framerates, y)
-
-                    print("{} ".format(val), end="")
-
-            elif type(framerates) is Gst.FractionRange:
-
-                min_val = Gst.value_get_fraction_range_min(framerates)
-                max_val = Gst.value_get_fraction_range_max(framerates)
-                print("{} <-> {}".format(min_val, max_val))
-
+            rate = size[0] * size[1] * pixel * fps
+            if best_rate is None or rate < best_rate:
+                best, best_rate = mode._replace(width=size[0], height=size[1], max_width=size[0], max_height=size[1],
+                                                width_step=1, height_step=1), rate
+        return best
+
+    def print_formats(self, native=False) -> List[VideoMode]:
+        modes = self.formats(native)
+        for mode in modes:
+            size = f'{mode.width}x{mode.height}'
+            if (mode.max_width, mode.max_height) != (mode.width, mode.height):
+                size += f' <=> {mode.max_width}x{mode.max_height}'
+                if (mode.width_step, mode.height_step) != (1, 1):
+                    size += f' step {mode.width_step}x{mode.height_step}'
+            if mode.framerates:
+                rates = ' '.join(f'{rate:g}' for rate in mode.framerates)
             else:
-                print("framerates not supported {}".format(type(framerates)))
-                # we are finished
-            print("")
+                rates = f'{mode.min_fps:g} <-> {mode.max_fps:g}'
+            print(f'{mode.media} {mode.format} - {size} - {rates}')
+        return modes
 
     @staticmethod
-    def callback(app_sink, obj: 'ISource'):
+    def callback(app_sink, obj: FrameOutput):
         """
         This function will be called in a separate thread when our appsink
         says there is data for us. user_data has to be defined
         when calling g_signal_connect. It can be used to pass objects etc.
         from your other function to the callback.
         """
+        start = perf_counter()
         sample = app_sink.emit("pull-sample")
         if sample:
             caps = sample.get_caps()
+            if obj.caps is None or not caps.is_equal(obj.caps):
+                obj.format = FrameFormat.from_caps(caps)
+                obj.caps = caps
             gst_buffer = sample.get_buffer()
+            (ret, buffer_map) = gst_buffer.map(Gst.MapFlags.READ)
+            if not ret:
+                return Gst.FlowReturn.OK
             try:
-                (ret, buffer_map) = gst_buffer.map(Gst.MapFlags.READ)
-                video_info = GstVideo.VideoInfo()
-                video_info.from_caps(caps)
-
-                np_data = np.frombuffer(buffer_map.data, np.uint8).reshape((video_info.height, video_info.width, 3))
-                with obj.lock:
-                    buffer = obj.buffer
-                    if buffer is None or buffer.shape != np_data.shape:
-                        obj.buffer = np_data.copy()
-                    else:
-                        np.copyto(buffer, np_data)
+                obj.ring.write(obj.format.view(buffer_map.data), obj.capture_time(sample), obj.format)
             finally:
                 gst_buffer.unmap(buffer_map)
+            if obj.metrics is not None:
+                obj.metrics.callback_done(perf_counter() - start)
 
         return Gst.FlowReturn.OK
 
-    def play(self):
+    def capture_time(self, sample) -> float:
+        """
+        Capture time of a sample from its PTS. The pipeline runs on the
+        monotonic system clock, so this is comparable with time.monotonic().
+        """
+        pts = sample.get_buffer().pts
+        if pts == Gst.CLOCK_TIME_NONE:
+            return monotonic()
+        running_time = sample.get_segment().to_running_time(Gst.Format.TIME, pts)
+        return (self.pipeline.get_base_time() + running_time) / Gst.SECOND
+
+    @staticmethod
+    def clock() -> 'Gst.Clock':
+        """
+        The monotonic system clock all pipelines run on.
+        """
+        clock = Gst.SystemClock.obtain()
+        clock.set_property("clock-type", Gst.ClockType.MONOTONIC)
+        return clock
+
+    def play(self, base_time: Optional[int] = None):
+        """
+        Start capturing. Pipelines started with the same base_time (in clock
+        nanoseconds) also share their running time, e.g. for recordings.
+        """
+        self.pipeline.use_clock(self.clock())
+        if base_time is not None:
+            self.pipeline.set_start_time(Gst.CLOCK_TIME_NONE)
+            self.pipeline.set_base_time(base_time)
         sink = self.pipeline.get_by_name("sink")
         # tell appsink to notify us when it receives an image
         sink.set_property("emit-signals", True)
         sink.connect("new-sample", self.callback, self)
+        for name, output in self.outputs.items():
+            sink = self.pipeline.get_by_name(name)
+            sink.set_property("emit-signals", True)
+            sink.connect("new-sample", self.callback, output)
         self.pipeline.set_state(Gst.State.PLAYING)
 
-    def read(self):
-        with self.lock:
-            return self.buffer.copy() if self.buffer is not None else None
+    def stop(self):
+        self.pipeline.set_state(Gst.State.NULL)
 
 
 if __name__ == "__main__":
+    import cv2
     devs = ISource.list_devices()
     src = ISource(#file_mask='out/video_%03d.mp4',
                   encode={'encoder': 'x264enc', 'qp-min': 18, 'speed-preset': 'superfast'})
     src.print_formats()
     src.set_format(1920, 1080, 30, fmt='BGRx')
 
-    src.camera.set_tcam_property("Exposure Auto", False)
-    src.camera.set_tcam_property("Gain Auto", False)
-
-    src.camera.set_tcam_property("Exposure", 3000)
-    src.camera.set_tcam_property("Zoom", 0)
+    src.properties.apply_profile({'Exposure Auto': False, 'Gain Auto': False, 'Exposure': 3000, 'Zoom': 0})
     src.play()
     # src.set_format(640, 480, 30, fmt='BGRx')
     while True:
-        image = src.read()
-        if image is not None:
-            cv2.imshow('data', image)
+        frame = src.read_next(timeout=1)
+        if frame is not None:
+            with frame:
+                cv2.imshow('data', frame.bgr())
             k = cv2.waitKey(20)
             if k == ord('='):
                 src.zoom += 1
-                src.camera.set_tcam_property("Zoom", src.zoom)
+                src.properties.set('Zoom', src.zoom)
             elif k == ord('-'):
                 src.zoom -= 1
-                src.camera.set_tcam_property("Zoom", src.zoom)
+                src.properties.set('Zoom', src.zoom)
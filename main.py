@@ -3,58 +3,82 @@ from argparse import ArgumentParser
 
 from gimbal import Gimbal
 from isource import ISource
-from time import sleep
+from writer import ImageWriter
+from tracker import BrightSpotDetector, Intrinsics, Tracker, print_latency
+from time import monotonic, sleep
 
 
 def main():
     parser = ArgumentParser(description='Camera auto aimer')
     parser.add_argument('-g', action='store_true', help='Run with GUI')
+    parser.add_argument('--encoder', default='png', choices=['png', 'jpeg', 'raw'], help='Image file format')
+    parser.add_argument('--track', type=float, metavar='SECONDS', help='Track the brightest spot instead of scanning')
+    parser.add_argument('--hfov', type=float, default=60.0, help='Horizontal field of view at zoom 0, degrees')
     args = parser.parse_args()
 
     ISource.list_devices()
 
-    src = ISource()
-    src.set_format(1920, 1080, 30, fmt='BGRx')
+    if args.track:
+        # detection runs on a small grey stream scaled inside the pipeline, which cannot scale Bayer
+        src = ISource(outputs={'analysis': {'width': 480, 'height': 270, 'fps': 30, 'fmt': 'GRAY8'}})
+        src.set_format(1920, 1080, 30, fmt='BGRx')
+    else:
+        # queued frames stay checked out until saved: the writer's queue and workers plus two buffers
+        src = ISource(buffers=8)
+        src.set_format(1920, 1080, 30, fmt='auto')
 
-    src.camera.set_tcam_property("Exposure Auto", False)
-    src.camera.set_tcam_property("Gain Auto", False)
-
-    src.camera.set_tcam_property("Exposure", 3000)
-    src.camera.set_tcam_property("Zoom", 0)
+    src.properties.apply_profile({'Exposure Auto': False, 'Gain Auto': False, 'Exposure': 3000, 'Zoom': 0})
     src.play()
     print('Play started')
 
     gimbal = Gimbal('/dev/ttyUSB0', baudrate=115200, timeout=10)
     gimbal.motors_on()
 
+    if args.track:
+        intrinsics = Intrinsics.from_fov(1920, 1080, args.hfov)
+        with Tracker(src.outputs['analysis'], gimbal, BrightSpotDetector(), intrinsics) as tracker:
+            sleep(args.track)
+        print(f'Frames: {tracker.frames}, detections: {tracker.detections}')
+        print_latency(tracker.latency())
+        gimbal.motors_off()
+        return
+
+    writer = ImageWriter(args.encoder, queue_size=4)
     idx = 0
 
-    def go(r, p, y):
+    def capture(pose, data):
         nonlocal idx
-        gimbal.control_angle(r, p, y)
-        image = None
-        while image is None:
-            sleep(0.6)
-            image = src.read()
+        # only a frame captured after the gimbal settled is sharp
+        frame = src.read_after(monotonic(), timeout=1)
+        if frame is None:
+            print('No frame at', pose)
+            return
         if args.g:
-            cv2.imshow('Image', image)
+            with frame:
+                cv2.imshow('Image', frame.bgr())
             cv2.waitKey()
         else:
             idx += 1
-            cv2.imwrite(f'img_{idx:03}.png', image)
-
-    go(0, 0, 0)
-    go(0, -30, 0)
-    go(0, -30, 30)
-    go(0, 30, 30)
-    go(0, 30, -30)
-    go(0, 0, -30)
-    go(0, 0, 0)
-    go(0, -15, 0)
-    go(0, -30, 0)
-    go(0, -45, 0)
-    go(0, -60, 0)
+            # the writer converts and saves the frame in the background and then releases it
+            writer.write(f'img_{idx:03}', frame, {'pose': pose, 'timestamp': frame.timestamp})
+
+    gimbal.run_sequence([
+        (0, 0, 0),
+        (0, -30, 0),
+        (0, -30, 30),
+        (0, 30, 30),
+        (0, 30, -30),
+        (0, 0, -30),
+        (0, 0, 0),
+        (0, -15, 0),
+        (0, -30, 0),
+        (0, -45, 0),
+        (0, -60, 0),
+    ], capture)
     gimbal.motors_off()
+    writer.close()
+    print('Images written: {}, dropped: {}, errors: {}'.format(*writer.stats()))
+    print('Frames received: {}, dropped: {}, skipped: {}'.format(*src.stats()))
 
 
 # Press the green button in the gutter to run the script.
@@ -0,0 +1,199 @@
+from typing import Callable, Dict, List, NamedTuple, Optional
+from collections import OrderedDict
+from threading import Thread, Lock, Event
+from time import monotonic, perf_counter
+
+from isource import Gst
+
+
+class ElementMetrics(NamedTuple):
+    buffers: int  # entering the element during the interval
+    fps: float
+    latency: float  # average seconds from the sink pad to a src pad, 0 for sinks
+    max_latency: float
+
+
+class QueueLevel(NamedTuple):
+    buffers: int
+    max_buffers: int
+    time: float  # seconds of data queued
+    overruns: int  # times the queue was full, since attaching
+
+
+class MetricsSnapshot(NamedTuple):
+    time: float
+    interval: float
+    elements: Dict[str, ElementMetrics]
+    queues: Dict[str, QueueLevel]
+    dropped: Dict[str, int]  # buffers dropped per element as reported by QoS, since attaching
+    callback_calls: int
+    callback_time: float  # average seconds in the appsink callback
+    callback_max: float
+
+
+class _ElementCounter:
+    __slots__ = 'buffers', 'latency', 'max_latency', 'latency_count', 'arrivals'
+
+    def __init__(self):
+        self.buffers = 0
+        self.latency = 0.0
+        self.max_latency = 0.0
+        self.latency_count = 0
+        self.arrivals: OrderedDict = OrderedDict()
+
+
+class PipelineMetrics:
+    """
+    Opt-in instrumentation of a pipeline: buffer probes on the pads of every
+    top level element count buffers and measure the time a buffer (matched
+    by PTS) spends between entering and leaving an element. Queue fill
+    levels are sampled on snapshot(), QoS drops are counted from the bus and
+    the appsink callback reports its own duration through callback_done().
+
+        metrics = PipelineMetrics(src.pipeline)
+        metrics.start(1.0, print_snapshot)
+
+    Counters restart with every snapshot, which therefore covers the time
+    since the previous one.
+    """
+    max_arrivals = 64
+
+    def __init__(self, pipeline: 'Gst.Pipeline'):
+        self.pipeline = pipeline
+        self.lock = Lock()
+        self.counters: Dict[str, _ElementCounter] = {}
+        self.queues: List['Gst.Element'] = []
+        self.overruns: Dict[str, int] = {}
+        self.dropped: Dict[str, int] = {}
+        self.callback_calls = 0
+        self.callback_time = 0.0
+        self.callback_max = 0.0
+        self.last_snapshot = monotonic()
+        self.stopped = Event()
+        self.thread: Optional[Thread] = None
+        self.attach()
+
+    def attach(self):
+        iterator = self.pipeline.iterate_elements()
+        while True:
+            result, element = iterator.next()
+            if result != Gst.IteratorResult.OK:
+                break
+            name = element.get_name()
+            self.counters[name] = _ElementCounter()
+            for pad in element.sinkpads:
+                pad.add_probe(Gst.PadProbeType.BUFFER, self._sink_probe, name)
+            for pad in element.srcpads:
+                pad.add_probe(Gst.PadProbeType.BUFFER, self._src_probe, name)
+            factory = element.get_factory()
+            if factory is not None and factory.get_name() == 'queue':
+                self.queues.append(element)
+                self.overruns[name] = 0
+                element.connect('overrun', self._overrun)
+        bus = self.pipeline.get_bus()
+        bus.enable_sync_message_emission()
+        bus.connect('sync-message', self._message)
+
+    def _sink_probe(self, pad, info, name: str):
+        counter = self.counters[name]
+        pts = info.get_buffer().pts
+        with self.lock:
+            counter.buffers += 1
+            arrivals = counter.arrivals
+            arrivals[pts] = perf_counter()
+            if len(arrivals) > self.max_arrivals:
+                arrivals.popitem(last=False)
+        return Gst.PadProbeReturn.OK
+
+    def _src_probe(self, pad, info, name: str):
+        counter = self.counters[name]
+        now = perf_counter()
+        with self.lock:
+            arrival = counter.arrivals.get(info.get_buffer().pts)
+            if arrival is not None:
+                latency = now - arrival
+                counter.latency += latency
+                counter.latency_count += 1
+                counter.max_latency = max(counter.max_latency, latency)
+        return Gst.PadProbeReturn.OK
+
+    def _overrun(self, queue):
+        with self.lock:
+            self.overruns[queue.get_name()] += 1
+
+    def _message(self, bus, message):
+        if message.type == Gst.MessageType.QOS:
+            _, _, dropped = message.parse_qos_stats()
+            name = message.src.get_name()
+            with self.lock:
+                self.dropped[name] = dropped
+
+    def callback_done(self, duration: float):
+        """
+        Account one appsink callback of duration seconds.
+        """
+        with self.lock:
+            self.callback_calls += 1
+            self.callback_time += duration
+            self.callback_max = max(self.callback_max, duration)
+
+    def snapshot(self) -> MetricsSnapshot:
+        now = monotonic()
+        queues = {
+            queue.get_name(): QueueLevel(queue.get_property('current-level-buffers'),
+                                         queue.get_property('max-size-buffers'),
+                                         queue.get_property('current-level-time') / Gst.SECOND,
+                                         self.overruns[queue.get_name()])
+            for queue in self.queues
+        }
+        with self.lock:
+            interval = now - self.last_snapshot
+            self.last_snapshot = now
+            elements = {}
+            for name, counter in self.counters.items():
+                latency = counter.latency / counter.latency_count if counter.latency_count else 0.0
+                elements[name] = ElementMetrics(counter.buffers, counter.buffers / interval if interval else 0.0,
+                                                latency, counter.max_latency)
+                counter.buffers = counter.latency_count = 0
+                counter.latency = counter.max_latency = 0.0
+            average = self.callback_time / self.callback_calls if self.callback_calls else 0.0
+            snapshot = MetricsSnapshot(now, interval, elements, queues, dict(self.dropped),
+                                       self.callback_calls, average, self.callback_max)
+            self.callback_calls = 0
+            self.callback_time = self.callback_max = 0.0
+        return snapshot
+
+    def start(self, interval: float = 1.0, callback: Callable[[MetricsSnapshot], None] = None) -> 'PipelineMetrics':
+        """
+        Take a snapshot every interval seconds on a background thread and pass it to callback.
+        """
+        callback = callback or print_snapshot
+        if self.thread is None:
+            self.stopped.clear()
+
+            def run():
+                while not self.stopped.wait(interval):
+                    callback(self.snapshot())
+
+            self.thread = Thread(target=run, name='pipeline-metrics', daemon=True)
+            self.thread.start()
+        return self
+
+    def stop(self):
+        if self.thread is not None:
+            self.stopped.set()
+            self.thread.join()
+            self.thread = None
+
+
+def print_snapshot(snapshot: MetricsSnapshot):
+    print(f'Pipeline metrics over {snapshot.interval:.1f} s:')
+    for name, item in snapshot.elements.items():
+        print(f'  {name:24} {item.fps:7.1f} fps  latency {item.latency * 1e3:7.2f} ms  max {item.max_latency * 1e3:7.2f} ms')
+    for name, level in snapshot.queues.items():
+        print(f'  {name:24} {level.buffers}/{level.max_buffers} buffers  {level.time * 1e3:.1f} ms  '
+              f'overruns {level.overruns}')
+    for name, dropped in snapshot.dropped.items():
+        print(f'  {name:24} dropped {dropped}')
+    if snapshot.callback_calls:
+        print(f'  appsink callback {snapshot.callback_time * 1e3:.2f} ms avg, {snapshot.callback_max * 1e3:.2f} ms max')
@@ -0,0 +1,80 @@
+from typing import Any, Callable, NamedTuple, Optional
+from time import monotonic
+
+from gimbal import CMD_REALTIME_DATA_CUSTOM, REALTIME_CUSTOM_IMU_ANGLES, AngleHistory, Angles, GimbalBase
+
+
+class PosedFrame(NamedTuple):
+    image: Any
+    timestamp: float
+    seq: int
+    pose: Angles
+    telemetry_gap: float  # seconds between the frame and the nearest angle sample, 0 if interpolated
+    age: float  # seconds from capture to tagging
+
+
+def tag_frame(frame, history: AngleHistory, now: Optional[float] = None) -> Optional[PosedFrame]:
+    """
+    Attach the gimbal attitude at capture time to a frame from
+    ISource.read_frame(). Returns None while there is no telemetry yet.
+    """
+    sample = history.at(frame.timestamp)
+    if sample is None:
+        return None
+    now = monotonic() if now is None else now
+    return PosedFrame(frame.image, frame.timestamp, frame.seq, sample.angles, sample.gap, now - frame.timestamp)
+
+
+class PoseTagger:
+    """
+    Reads frames from an ISource and tags them with the gimbal attitude at
+    capture time. Frames older than max_age or without telemetry within
+    max_gap are dropped and counted instead of being returned.
+
+        with PoseTagger(src, gimbal) as tagger:
+            frame = tagger.read()
+    """
+    def __init__(self, source, gimbal: GimbalBase, max_age: float = 0.1, max_gap: float = 0.05,
+                 interval_ms: int = 10):
+        self.source = source
+        self.gimbal = gimbal
+        self.max_age = max_age
+        self.max_gap = max_gap
+        self.interval_ms = interval_ms
+        self.unsubscribe: Optional[Callable[[], None]] = None
+        self.last_seq = 0
+        self.dropped = 0
+
+    def start(self) -> 'PoseTagger':
+        """
+        Stream IMU angles into gimbal.history; the gimbal keeps them on decoding.
+        """
+        if self.unsubscribe is None:
+            self.unsubscribe = self.gimbal.subscribe(lambda _: None, CMD_REALTIME_DATA_CUSTOM,
+                                                     self.interval_ms, REALTIME_CUSTOM_IMU_ANGLES)
+        return self
+
+    def stop(self):
+        if self.unsubscribe is not None:
+            self.unsubscribe()
+            self.unsubscribe = None
+
+    def __enter__(self) -> 'PoseTagger':
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def read(self) -> Optional[PosedFrame]:
+        """
+        The latest frame not returned before, tagged with its pose, or None.
+        """
+        frame = self.source.read_frame()
+        if frame is None or frame.seq == self.last_seq:
+            return None
+        self.last_seq = frame.seq
+        tagged = tag_frame(frame, self.gimbal.history)
+        if tagged is None or tagged.age > self.max_age or tagged.telemetry_gap > self.max_gap:
+            self.dropped += 1
+            return None
+        return tagged
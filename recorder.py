@@ -0,0 +1,195 @@
+from typing import Iterator, List, NamedTuple, Optional
+from struct import Struct
+from threading import Lock
+from time import monotonic, monotonic_ns, sleep
+import mmap
+import os
+
+from gimbal import GimbalBase
+
+# Log layout: MAGIC, then records of RECORD_HEADER (monotonic time in ns,
+# direction, length) followed by the raw bytes.
+MAGIC = b'SBGCLOG1'
+RECORD_HEADER = Struct('<QBH')
+
+RX = 0
+TX = 1
+
+
+class LogRecord(NamedTuple):
+    timestamp_ns: int
+    direction: int
+    data: bytes
+
+
+class Recorder:
+    """
+    Append-only log of raw traffic: every chunk received from and every
+    frame sent to the gimbal, with monotonic timestamps.
+    """
+    def __init__(self, path: str):
+        self.lock = Lock()
+        self.file = open(path, 'ab')
+        if self.file.tell() == 0:
+            self.file.write(MAGIC)
+
+    def record(self, direction: int, data: bytes):
+        timestamp = monotonic_ns()
+        with self.lock:
+            for pos in range(0, len(data), 0xFFFF):
+                chunk = data[pos:pos + 0xFFFF]
+                self.file.write(RECORD_HEADER.pack(timestamp, direction, len(chunk)))
+                self.file.write(chunk)
+
+    def received(self, data: bytes):
+        self.record(RX, data)
+
+    def sent(self, data: bytes):
+        self.record(TX, data)
+
+    def flush(self):
+        with self.lock:
+            self.file.flush()
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+
+def read_log(path: str) -> Iterator[LogRecord]:
+    """
+    Iterate over the records of a traffic log through mmap.
+    """
+    with open(path, 'rb') as file:
+        if os.fstat(file.fileno()).st_size <= len(MAGIC):
+            return
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            if data[:len(MAGIC)] != MAGIC:
+                raise ValueError(f'{path} is not a gimbal traffic log')
+            pos = len(MAGIC)
+            end = len(data) - RECORD_HEADER.size
+            while pos <= end:
+                timestamp, direction, size = RECORD_HEADER.unpack_from(data, pos)
+                pos += RECORD_HEADER.size
+                if pos + size > len(data):
+                    return  # truncated by a crash while recording
+                yield LogRecord(timestamp, direction, data[pos:pos + size])
+                pos += size
+
+
+class LogStream(NamedTuple):
+    data: bytes  # the recorded chunks of one direction joined into the byte stream
+    offsets: List[int]  # position of each chunk in data
+    timestamps_ns: List[int]  # monotonic time each chunk was recorded
+
+
+def is_log(path: str) -> bool:
+    with open(path, 'rb') as file:
+        return file.read(len(MAGIC)) == MAGIC
+
+
+def read_stream(path: str, direction: int = RX) -> LogStream:
+    """
+    The bytes received (or sent) in a traffic log as one stream, as frames
+    are usually split over several read chunks.
+    """
+    chunks, offsets, timestamps = [], [], []
+    size = 0
+    for record in read_log(path):
+        if record.direction == direction and record.data:
+            chunks.append(record.data)
+            offsets.append(size)
+            timestamps.append(record.timestamp_ns)
+            size += len(record.data)
+    return LogStream(b''.join(chunks), offsets, timestamps)
+
+
+class ReplaySerial:
+    """
+    Stand-in for serial.Serial that plays back the received side of a traffic
+    log. With realtime=True bytes become readable at the pace they were
+    recorded (scaled by speed), otherwise as fast as they are read. Written
+    data is discarded. Reading past the end of the log raises EOFError.
+    """
+    def __init__(self, path: str, realtime: bool = True, speed: float = 1.0, timeout: Optional[float] = 1.0):
+        self.records = [(r.timestamp_ns, r.data) for r in read_log(path) if r.direction == RX]
+        self.realtime = realtime
+        self.speed = speed
+        self.timeout = timeout
+        self.is_open = True
+        self.index = 0
+        self.pending = memoryview(b'')
+        self.started: Optional[float] = None
+        self.cancelled = False
+
+    def _due(self, index: int) -> float:
+        """
+        Time in seconds from the start of the replay when record index is readable.
+        """
+        if not self.realtime:
+            return 0.0
+        return (self.records[index][0] - self.records[0][0]) / 1e9 / self.speed
+
+    def _elapsed(self) -> float:
+        if self.started is None:
+            self.started = monotonic()
+        return monotonic() - self.started
+
+    @property
+    def in_waiting(self) -> int:
+        elapsed = self._elapsed()
+        size = len(self.pending)
+        index = self.index
+        while index < len(self.records) and self._due(index) <= elapsed:
+            size += len(self.records[index][1])
+            index += 1
+        return size
+
+    def read(self, size: int = 1) -> bytes:
+        if not self.is_open:
+            raise EOFError('Replay is closed')
+        self.cancelled = False
+        deadline = None if self.timeout is None else self._elapsed() + self.timeout
+        result = bytearray()
+        while len(result) < size:
+            if not self.pending:
+                if self.index >= len(self.records):
+                    if not result:
+                        raise EOFError('End of replayed log')
+                    break
+                wait = self._due(self.index) - self._elapsed()
+                if wait > 0:
+                    if result or self.cancelled:
+                        break
+                    if deadline is not None:
+                        wait = min(wait, deadline - self._elapsed())
+                        if wait <= 0:
+                            break
+                    sleep(min(wait, 0.1))
+                    continue
+                self.pending = memoryview(self.records[self.index][1])
+                self.index += 1
+            chunk = self.pending[:size - len(result)]
+            result += chunk
+            self.pending = self.pending[len(chunk):]
+        return bytes(result)
+
+    def write(self, data: bytes) -> int:
+        return len(data)
+
+    def cancel_read(self):
+        self.cancelled = True
+
+    def close(self):
+        self.is_open = False
+
+
+class ReplayGimbal(GimbalBase, ReplaySerial):
+    """
+    Gimbal reading its responses from a traffic log instead of a port, e.g.
+    to reproduce a field problem or benchmark decoding at full speed:
+
+        gimbal = ReplayGimbal('flight.log', realtime=False)
+        while True:
+            gimbal.read_message()
+    """
@@ -0,0 +1,192 @@
+from typing import Dict, List, NamedTuple, Optional, Tuple, Union
+from typing import get_args, get_origin, get_type_hints
+from struct import calcsize
+import re
+import numpy as np
+
+from gimbal import (
+    ANGLE_UNIT, CMD_REALTIME_DATA_CUSTOM, Angles, RealtimeCustomLayout, RealtimeDataCustom, payloads_map,
+    _CRC16_TABLE, _REVERSE_BITS
+)
+from recorder import RX, is_log, read_stream
+
+_crc_table = np.array(_CRC16_TABLE, np.uint16)
+_reverse_bits = np.array(_REVERSE_BITS, np.uint16)
+
+_numpy_codes = {
+    'b': 'i1', 'B': 'u1', 'h': '<i2', 'H': '<u2', 'i': '<i4', 'I': '<u4', 'l': '<i4', 'L': '<u4',
+    'q': '<i8', 'Q': '<u8', 'e': '<f2', 'f': '<f4', 'd': '<f8', '?': '?', 'x': 'V1',
+}
+
+
+class Column(NamedTuple):
+    name: str
+    start: int
+    count: int
+    shape: Tuple[int, ...]
+    scale: Optional[float]
+
+
+def struct_dtype(fmt: str) -> np.dtype:
+    """
+    Packed NumPy dtype with one field per item struct.unpack(fmt) would
+    return, named f0, f1, ...
+    """
+    if fmt[:1] not in '<=!>@':
+        fmt = '<' + fmt
+    if fmt[0] in '>!':
+        raise ValueError('Only little-endian formats are supported')
+    names, formats, offsets = [], [], []
+    offset = 0
+    for count, code in re.findall(r'(\d*)([a-zA-Z?])', fmt[1:]):
+        count = int(count) if count else 1
+        if code == 's':
+            names.append(f'f{len(names)}')
+            formats.append(f'S{count}')
+            offsets.append(offset)
+            offset += count
+        elif code == 'x':
+            offset += count
+        else:
+            size = calcsize('<' + code)
+            for _ in range(count):
+                names.append(f'f{len(names)}')
+                formats.append(_numpy_codes[code])
+                offsets.append(offset)
+                offset += size
+    return np.dtype({'names': names, 'formats': formats, 'offsets': offsets, 'itemsize': offset})
+
+
+def _shape(ft) -> Tuple[Tuple[int, ...], int]:
+    if ft in (int, float, bytes):
+        return (), 1
+    if hasattr(ft, '_fields'):
+        types = tuple(get_type_hints(ft).values()) if not hasattr(ft, 'from_items') else (int,) * len(ft._fields)
+    elif get_origin(ft) is tuple:
+        types = get_args(ft)
+    else:
+        raise TypeError(f'Can not decode field of type {ft}')
+    shapes = [_shape(t) for t in types]
+    count = sum(size for _, size in shapes)
+    if all(shape == shapes[0][0] for shape, _ in shapes):
+        return (len(shapes),) + shapes[0][0], count
+    return (count,), count
+
+
+def columns_plan(msg_type) -> List[Column]:
+    """
+    Columns of a payload type: which unpacked items make every top-level
+    field, their shape per message and the scale to apply.
+    """
+    columns = []
+    start = 0
+    for name, ft in get_type_hints(msg_type).items():
+        shape, count = _shape(ft)
+        columns.append(Column(name, start, count, shape, ANGLE_UNIT if ft is Angles else None))
+        start += count
+    return columns
+
+
+def _custom_columns_plan(layout: RealtimeCustomLayout) -> List[Column]:
+    names = RealtimeDataCustom._fields
+    columns = [Column(names[0], 0, 1, (), None)]
+    start = 1
+    for index, count, convert in layout.fields:
+        columns.append(Column(names[index], start, count, (count,), ANGLE_UNIT if convert is Angles.from_items else None))
+        start += count
+    return columns
+
+
+def _crc16(rows: np.ndarray) -> np.ndarray:
+    crc = np.zeros(len(rows), np.uint16)
+    for column in rows.T:
+        crc = (crc >> 8) ^ _crc_table[(crc ^ column) & 0xFF]
+    return (_reverse_bits[crc & 0xFF] << 8) | _reverse_bits[crc >> 8]
+
+
+def _gather(data: np.ndarray, starts: np.ndarray, size: int) -> np.ndarray:
+    return np.lib.stride_tricks.sliding_window_view(data, size)[starts]
+
+
+def find_frames(data: np.ndarray) -> np.ndarray:
+    """
+    Offsets of all frames with valid header checksum and CRC in a byte array,
+    skipping garbage the same way FrameParser does.
+    """
+    candidates = np.flatnonzero(data[:-3] == 0x24)
+    header_ok = (data[candidates + 1].astype(np.uint16) + data[candidates + 2]) % 256 == data[candidates + 3]
+    candidates = candidates[header_ok]
+    ends = candidates + data[candidates + 2].astype(np.int64) + 6
+    complete = ends <= len(data)
+    candidates, ends = candidates[complete], ends[complete]
+
+    while True:
+        following = np.searchsorted(candidates, ends).tolist()
+        chain = []
+        k, count = 0, len(candidates)
+        while k < count:
+            chain.append(k)
+            k = following[k]
+        chain = np.array(chain, np.int64)
+
+        bad = []
+        starts = candidates[chain]
+        sizes = data[starts + 2]
+        for size in np.unique(sizes):
+            group = chain[sizes == size]
+            group_starts = candidates[group]
+            rows = _gather(data, group_starts + 1, int(size) + 3)
+            crc = data[group_starts + 4 + size].astype(np.uint16) | (data[group_starts + 5 + size].astype(np.uint16) << 8)
+            bad.append(group[_crc16(rows) != crc])
+        bad = np.concatenate(bad) if bad else np.zeros(0, np.int64)
+        if not len(bad):
+            return starts
+        keep = np.ones(len(candidates), bool)
+        keep[bad] = False
+        candidates, ends = candidates[keep], ends[keep]
+
+
+def decode_frames(data: Union[bytes, bytearray, memoryview, np.ndarray, str],
+                  custom_layout: Optional[RealtimeCustomLayout] = None) -> Dict[int, Dict[str, np.ndarray]]:
+    """
+    Decode a recording of raw SimpleBGC frames, given as a buffer or a file
+    name, into columns per command id. Nested fields become 2D/3D arrays and
+    angles are scaled to degrees. Every table also has an `offset` column
+    with the position of each frame in the input.
+    A traffic log of recorder.py is decoded from its received bytes, then
+    `timestamp` holds the monotonic seconds each frame was completely read.
+    CMD_REALTIME_DATA_CUSTOM frames are decoded only if their layout is given.
+    """
+    stream = None
+    if isinstance(data, str) and is_log(data):
+        stream = read_stream(data, RX)
+        data = stream.data
+    if isinstance(data, str):
+        data = np.memmap(data, np.uint8, 'r')
+    elif not isinstance(data, np.ndarray):
+        data = np.frombuffer(data, np.uint8)
+    starts = find_frames(data)
+    command_ids = data[starts + 1]
+    result = {}
+    for command_id in np.unique(command_ids).tolist():
+        if command_id == CMD_REALTIME_DATA_CUSTOM and custom_layout is not None:
+            fmt, plan = custom_layout.struct.format, _custom_columns_plan(custom_layout)
+        elif command_id in payloads_map:
+            msg_type = payloads_map[command_id]
+            fmt, plan = msg_type.format().struct_format, columns_plan(msg_type)
+        else:
+            continue
+        dtype = struct_dtype(fmt)
+        group = starts[(command_ids == command_id) & (data[starts + 2] == dtype.itemsize)]
+        records = _gather(data, group + 4, dtype.itemsize).view(dtype)[:, 0]
+        columns = {}
+        for column in plan:
+            items = [records[f'f{i}'] for i in range(column.start, column.start + column.count)]
+            values = items[0] if column.count == 1 else np.stack(items, axis=1).reshape((len(group),) + column.shape)
+            columns[column.name] = values * column.scale if column.scale is not None else values
+        columns['offset'] = group
+        if stream is not None:
+            chunk = np.searchsorted(stream.offsets, group + dtype.itemsize + 5, side='right') - 1
+            columns['timestamp'] = np.array(stream.timestamps_ns, np.int64)[chunk] / 1e9
+        result[command_id] = columns
+    return result
@@ -0,0 +1,111 @@
+from threading import Thread
+from time import monotonic, sleep
+
+import numpy as np
+import pytest
+
+from frames import FrameRing
+from isource import FrameOutput
+
+
+def frame(value: int, shape=(4, 6)) -> np.ndarray:
+    return np.full(shape, value, np.uint8)
+
+
+def test_checkout_shares_the_buffer():
+    ring = FrameRing(3)
+    assert ring.checkout() is None
+    seq = ring.write(frame(1), 1.0)
+    with ring.checkout() as ref:
+        assert (ref.seq, ref.timestamp) == (seq, 1.0)
+        assert ref.image is ring.buffers[ref.index]
+        assert (ref.image == 1).all()
+        assert ring.checkout(after=seq) is None
+    assert ref.image is None
+
+
+def test_strided_view_is_compacted():
+    ring = FrameRing(2)
+    padded = np.arange(4 * 8, dtype=np.uint8).reshape(4, 8)
+    ring.write(padded[:, :6], 0.0)
+    with ring.checkout() as ref:
+        assert ref.image.flags.c_contiguous
+        assert (ref.image == padded[:, :6]).all()
+
+
+def test_held_frames_are_not_overwritten():
+    ring = FrameRing(3)
+    ring.write(frame(1), 1.0)
+    held = ring.checkout()
+    for value in range(2, 6):
+        ring.write(frame(value), float(value))
+    assert (held.image == 1).all()
+    with ring.checkout() as latest:
+        assert (latest.image == 5).all()
+    held.release()
+
+
+def test_drop_when_every_buffer_is_held():
+    ring = FrameRing(2)
+    ring.write(frame(1), 1.0)
+    first = ring.checkout()
+    ring.write(frame(2), 2.0)
+    second = ring.checkout()
+    assert ring.write(frame(3), 3.0) == 0
+    assert ring.stats() == (3, 1, 0)
+    first.release()
+    second.release()
+    assert ring.write(frame(4), 4.0) > 0
+
+
+def test_skip_counts_unread_frames():
+    ring = FrameRing(3)
+    ring.write(frame(1), 1.0)
+    ring.write(frame(2), 2.0)  # replaces 1 unread
+    ring.checkout().release()
+    ring.write(frame(3), 3.0)  # 2 was read
+    ring.write(frame(4), 4.0)  # replaces 3 unread
+    assert ring.stats() == (4, 0, 2)
+
+
+def test_needs_two_buffers():
+    with pytest.raises(ValueError):
+        FrameRing(1)
+
+
+def produce(ring: FrameRing, timestamps, interval: float = 0.02) -> Thread:
+    def run():
+        for i, timestamp in enumerate(timestamps):
+            sleep(interval)
+            ring.write(frame(i + 1), timestamp)
+    thread = Thread(target=run)
+    thread.start()
+    return thread
+
+
+def test_wait_for_the_next_frame():
+    ring = FrameRing(3)
+    ring.write(frame(9), 0.0)
+    thread = produce(ring, [1.0])
+    with ring.wait(timeout=1) as ref:
+        assert ref.timestamp == 1.0
+    thread.join()
+
+
+def test_wait_for_a_frame_captured_after():
+    output = FrameOutput(3)
+    thread = produce(output.ring, [1.0, 2.0, 3.0, 4.0])
+    with output.read_after(2.5, timeout=1) as ref:
+        assert ref.timestamp == 3.0
+    thread.join()
+    with output.read_after(2.5, timeout=0) as ref:
+        assert ref.timestamp == 4.0  # already there, no waiting
+
+
+def test_wait_times_out():
+    output = FrameOutput(2)
+    output.ring.write(frame(1), 1.0)
+    start = monotonic()
+    assert output.read_next(timeout=0.05) is None
+    assert output.read_after(5.0, timeout=0.05) is None
+    assert monotonic() - start >= 0.1
@@ -0,0 +1,199 @@
+import asyncio
+import random
+from struct import calcsize, unpack
+from threading import Thread
+from time import sleep
+
+import pytest
+
+from agimbal import AsyncGimbal
+from control import ControlStreamer
+from emulator import Emulator
+from gimbal import (
+    CMD_BOARD_INFO, CMD_CONFIRM, CMD_REALTIME_DATA_3, BoardInfo, FrameEncoder, FrameParser, Gimbal, Message, RealtimeData3,
+    compile_decoder, deserialize
+)
+
+
+@pytest.fixture
+def emulator():
+    emulator = Emulator(baudrate=None, slew_rate=600.0)
+    yield emulator
+    emulator.close()
+
+
+@pytest.fixture
+def gimbal(emulator):
+    gimbal = Gimbal(emulator.serve_pty(), baudrate=115200, timeout=2)
+    yield gimbal
+    gimbal.close()
+
+
+def test_parser_resyncs_after_garbage_and_bad_crc():
+    encoder = FrameEncoder()
+    frames = [bytes(encoder.encode(command_id, bytes(range(command_id % 20)))) for command_id in (23, 67, 86)]
+    bad = bytearray(frames[1])
+    bad[-1] ^= 0xFF
+    stream = b'\x00$\x01' + frames[0] + bytes(bad) + b'$$' + frames[1] + frames[2]
+
+    parser = FrameParser()
+    received = []
+    rng = random.Random(1)
+    pos = 0
+    while pos < len(stream):
+        step = rng.randint(1, 7)
+        parser.feed(stream[pos:pos + step])
+        received.extend(parser)
+        pos += step
+
+    assert [bytes(Message(*m).pack()) for m in received] == frames
+    assert parser.crc_errors == 1
+    assert parser.skipped > 0
+
+
+@pytest.mark.parametrize('msg_type', [BoardInfo, RealtimeData3])
+def test_compiled_decoder_matches_deserialize(msg_type):
+    fmt = msg_type.format().struct_format
+    rng = random.Random(2)
+    for _ in range(20):
+        payload = bytes(rng.randrange(256) for _ in range(calcsize(fmt)))
+        assert compile_decoder(msg_type)(payload) == deserialize(msg_type, list(unpack(fmt, payload)))
+
+
+def test_requests(gimbal, emulator):
+    assert gimbal.board_info().firmware_ver == 2730
+    assert gimbal.motors_on()
+    assert emulator.motors_on
+    data = gimbal.move_to(0, 20, 0, timeout=5)
+    assert abs(data.imu_angle.pitch - 20) < 0.5
+    assert gimbal.motors_off()
+
+
+def test_polling_skips_stream_frames(gimbal, emulator):
+    gimbal.motors_on()
+    gimbal.start_stream(CMD_REALTIME_DATA_3, 20)
+    try:
+        sleep(0.1)
+        assert not gimbal.control_angle(0, 10, 0, auto=False)
+        assert gimbal.control_angle(0, 0, 0)
+        data = gimbal.move_to(0, 15, 0, timeout=5)
+        assert abs(data.imu_angle.pitch - 15) < 0.5
+    finally:
+        gimbal.stop_stream(CMD_REALTIME_DATA_3)
+
+
+def test_reader_routes_concurrent_requests(gimbal):
+    gimbal.start_reader()
+    results = []
+    threads = [Thread(target=lambda: results.append(gimbal.board_info())) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(results) == 8
+    assert all(info.firmware_ver == 2730 for info in results)
+
+
+def test_reader_survives_bad_payload_and_listener(gimbal, emulator):
+    gimbal.start_reader()
+    seen = []
+
+    def bad_listener(payload):
+        seen.append(payload)
+        raise ValueError('listener failure')
+
+    gimbal.router.add_listener(bad_listener)
+    emulator.send(CMD_CONFIRM, b'')  # empty confirmation, too short to decode
+    emulator.send(CMD_BOARD_INFO, b'\x01\x02')  # truncated board info
+    sleep(0.2)
+    assert gimbal.reader_thread is not None
+    assert len(seen) == 2
+    assert all(isinstance(payload, Message) for payload in seen)
+    assert gimbal.board_info().firmware_ver == 2730
+
+
+def test_undecodable_reply_fails_request(gimbal, emulator):
+    gimbal.start_reader()
+    future = gimbal.expect(CMD_BOARD_INFO)
+    emulator.send(CMD_BOARD_INFO, b'\x01\x02')
+    with pytest.raises(ValueError):
+        gimbal.wait(future, CMD_BOARD_INFO)
+    assert gimbal.board_info().firmware_ver == 2730
+
+
+@pytest.mark.parametrize('reader', [False, True])
+def test_corrupted_link(reader):
+    emulator = Emulator(baudrate=None, corruption=0.01, seed=3)
+    gimbal = Gimbal(emulator.serve_pty(), baudrate=115200, timeout=0.2)
+    try:
+        if reader:
+            gimbal.start_reader()
+        answered = 0
+        for _ in range(100):
+            try:
+                answered += gimbal.board_info().firmware_ver == 2730
+            except (TimeoutError, AssertionError):
+                pass
+        parser = gimbal.parser
+        assert answered > 50
+        assert parser.crc_errors + parser.header_errors + parser.skipped > 0
+    finally:
+        gimbal.close()
+        emulator.close()
+
+
+def test_control_streamer_sends_final_setpoint(gimbal, emulator):
+    streamer = ControlStreamer(gimbal, rate=10, repeat=True).start()
+    streamer.set_speeds(0, 20, 0)
+    sleep(0.3)
+    assert emulator.speeds[1] == pytest.approx(20, abs=0.1)
+    streamer.set_speeds(0, 0, 0)
+    streamer.stop()
+    sleep(0.2)
+    assert emulator.speeds == [0.0, 0.0, 0.0]
+
+
+def test_control_streamer_counts_failed_confirms():
+    emulator = Emulator(baudrate=None, latency=1.0)
+    gimbal = Gimbal(emulator.serve_pty(), baudrate=115200, timeout=2)
+    try:
+        streamer = ControlStreamer(gimbal, rate=50, repeat=True, confirm_timeout=5).start()
+        streamer.set_speeds(0, 5, 0)
+        sleep(0.2)
+        gimbal.router.fail(EOFError('link lost'))
+        streamer.stop()
+        stats = streamer.stats()
+        assert stats.confirmed == 0
+        assert stats.unconfirmed > 0
+        assert stats.confirm_latency == 0.0
+    finally:
+        gimbal.close()
+        emulator.close()
+
+
+def test_async_gimbal(emulator):
+    path = emulator.serve_pty()
+
+    async def run():
+        async with AsyncGimbal(path, timeout=2) as gimbal:
+            infos = await asyncio.gather(*[gimbal.board_info() for _ in range(10)])
+            assert await gimbal.motors_on()
+            confirm = await gimbal.control_angle(0, 10, 0)
+            return infos, confirm
+
+    infos, confirm = asyncio.run(run())
+    assert all(info.firmware_ver == 2730 for info in infos)
+    assert confirm
+    assert emulator.targets[1] == pytest.approx(10, abs=0.1)
+
+
+def test_async_gimbal_survives_bad_payload(emulator):
+    path = emulator.serve_pty()
+
+    async def run():
+        async with AsyncGimbal(path, timeout=2) as gimbal:
+            emulator.send(CMD_BOARD_INFO, b'\x01\x02')
+            await asyncio.sleep(0.2)
+            return await gimbal.board_info()
+
+    assert asyncio.run(run()).firmware_ver == 2730
@@ -0,0 +1,37 @@
+from isource import VideoMode, mode_has_fps, mode_size, parse_modes
+
+
+def test_parse_single_values():
+    modes = parse_modes('video/x-raw, format=(string)BGRx, width=(int)1920, height=(int)1080, '
+                        'framerate=(fraction)30/1;')
+    assert modes == [VideoMode('video/x-raw', 'BGRx', 1920, 1080, 1920, 1080, (30.0,), 30.0, 30.0)]
+
+
+def test_parse_lists():
+    modes = parse_modes('video/x-bayer, format=(string){ rggb, rggb16 }, width=(int)2592, height=(int)2048, '
+                        'framerate=(fraction){ 15/1, 60/1, 30/1 };')
+    assert [mode.format for mode in modes] == ['rggb', 'rggb16']
+    assert modes[0].framerates == (60.0, 30.0, 15.0)
+    assert (modes[0].min_fps, modes[0].max_fps) == (15.0, 60.0)
+    assert mode_has_fps(modes[0], 30) and not mode_has_fps(modes[0], 25)
+
+
+def test_parse_stepped_range():
+    mode, = parse_modes('video/x-raw, format=(string)GRAY8, width=(int)[ 256, 2592, 16 ], '
+                        'height=(int)[ 4, 2048, 4 ], framerate=(fraction)[ 1/1, 120/1 ];')
+    assert (mode.width, mode.max_width, mode.width_step) == (256, 2592, 16)
+    assert (mode.height, mode.max_height, mode.height_step) == (4, 2048, 4)
+    assert mode.framerates == () and (mode.min_fps, mode.max_fps) == (1.0, 120.0)
+    assert mode_has_fps(mode, 25) and not mode_has_fps(mode, 200)
+
+
+def test_mode_size():
+    mode, = parse_modes('video/x-raw, format=(string)GRAY8, width=(int)[ 256, 2592, 16 ], '
+                        'height=(int)[ 4, 2048, 4 ], framerate=(fraction)30/1;')
+    assert mode_size(mode, 1921, 1081) == (1936, 1084)
+    assert mode_size(mode, 100, 2) == (256, 4)
+    assert mode_size(mode, 2592, 2048) == (2592, 2048)
+    assert mode_size(mode, 2593, 100) is None
+    fixed, = parse_modes('video/x-raw, format=(string)BGRx, width=(int)1920, height=(int)1080;')
+    assert mode_size(fixed, 1280, 720) == (1920, 1080)
+    assert mode_size(fixed, 1920, 1200) is None
@@ -0,0 +1,58 @@
+import numpy as np
+import pytest
+
+from frames import FrameRing
+from gimbal import AngleHistory, Angles, angle_error
+from pose import tag_frame
+
+
+def test_interpolates_between_samples():
+    history = AngleHistory()
+    history.add(1.0, Angles(0.0, 10.0, 20.0))
+    history.add(2.0, Angles(2.0, 20.0, 10.0))
+    sample = history.at(1.25)
+    assert sample.gap == 0.0
+    assert sample.angles == pytest.approx((0.5, 12.5, 17.5))
+    assert history.at(2.0).angles == (2.0, 20.0, 10.0)
+
+
+def test_interpolates_across_wrap_around():
+    history = AngleHistory()
+    history.add(0.0, Angles(0.0, 0.0, 170.0))
+    history.add(1.0, Angles(0.0, 0.0, -170.0))
+    yaw = history.at(0.5).angles.yaw
+    assert angle_error(yaw, 180.0) == pytest.approx(0.0)
+    assert angle_error(history.at(0.75).angles.yaw, -175.0) == pytest.approx(0.0)
+
+
+def test_outside_the_buffer():
+    history = AngleHistory()
+    assert history.at(1.0) is None
+    history.add(1.0, Angles(0.0, 1.0, 2.0))
+    history.add(2.0, Angles(0.0, 3.0, 4.0))
+    assert history.at(0.5) == (Angles(0.0, 1.0, 2.0), 0.5)
+    assert history.at(2.25) == (Angles(0.0, 3.0, 4.0), 0.25)
+
+
+def test_keeps_order_and_capacity():
+    history = AngleHistory(capacity=4)
+    for t in range(10):
+        history.add(float(t), Angles(0.0, float(t), 0.0))
+    history.add(5.0, Angles(0.0, 99.0, 0.0))  # out of order, ignored
+    assert len(history) == 4
+    assert history.latest() == (9.0, Angles(0.0, 9.0, 0.0))
+    assert history.at(8.5).angles.pitch == pytest.approx(8.5)
+
+
+def test_tag_frame():
+    history = AngleHistory()
+    ring = FrameRing(2)
+    ring.write(np.zeros((2, 2), np.uint8), 1.5)
+    with ring.checkout() as frame:
+        assert tag_frame(frame, history) is None
+        history.add(1.0, Angles(0.0, 0.0, 0.0))
+        history.add(2.0, Angles(0.0, 10.0, 0.0))
+        posed = tag_frame(frame, history, now=1.6)
+    assert posed.timestamp == 1.5
+    assert posed.pose.pitch == pytest.approx(5.0)
+    assert posed.age == pytest.approx(0.1)
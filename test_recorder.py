@@ -0,0 +1,92 @@
+from time import monotonic, sleep
+
+import numpy as np
+import pytest
+
+from emulator import Emulator
+from gimbal import CMD_BOARD_INFO, CMD_REALTIME_DATA_3, Gimbal, RealtimeData3
+from recorder import MAGIC, RECORD_HEADER, RX, TX, Recorder, ReplayGimbal, ReplaySerial, read_log, read_stream
+from telemetry import decode_frames, find_frames
+
+
+@pytest.fixture
+def recording(tmp_path):
+    path = str(tmp_path / 'traffic.log')
+    emulator = Emulator(baudrate=None)
+    gimbal = Gimbal(emulator.serve_pty(), baudrate=115200, timeout=2, record=path)
+    try:
+        frames = []
+        unsubscribe = gimbal.subscribe(frames.append, CMD_REALTIME_DATA_3, interval_ms=5)
+        sleep(0.3)
+        unsubscribe()
+        gimbal.board_info()
+    finally:
+        gimbal.close()
+        emulator.close()
+    return path, frames
+
+
+def test_log_records(tmp_path):
+    path = str(tmp_path / 'raw.log')
+    recorder = Recorder(path)
+    recorder.received(b'$abc')
+    recorder.sent(b'x' * 70000)
+    recorder.close()
+    records = list(read_log(path))
+    assert [(r.direction, len(r.data)) for r in records] == [(RX, 4), (TX, 0xFFFF), (TX, 70000 - 0xFFFF)]
+    assert records[0].timestamp_ns <= records[1].timestamp_ns
+
+    with open(path, 'ab') as file:
+        file.write(b'\0' * 5)  # a record header cut short by a crash
+    assert len(list(read_log(path))) == 3
+    with open(path, 'rb') as file:
+        assert file.read(len(MAGIC)) == MAGIC
+
+
+def test_decode_recorded_log(recording):
+    path, frames = recording
+    assert len(frames) > 10
+    stream = read_stream(path, RX)
+    assert stream.offsets[0] == 0 and len(stream.data) == sum(len(r.data) for r in read_log(path) if r.direction == RX)
+
+    tables = decode_frames(path)
+    realtime = tables[CMD_REALTIME_DATA_3]
+    # the stream may deliver a frame or two after the subscription ended
+    assert len(realtime['offset']) >= len(frames)
+    np.testing.assert_allclose(realtime['imu_angle'][:len(frames)], [f.imu_angle for f in frames])
+    assert (realtime['timestamp'][1:] >= realtime['timestamp'][:-1]).all()
+    assert len(tables[CMD_BOARD_INFO]['offset']) == 1
+
+    sent = np.frombuffer(read_stream(path, TX).data, np.uint8)
+    assert sent[find_frames(sent) + 1].tolist()[-1] == CMD_BOARD_INFO
+
+
+def test_replay(recording):
+    path, frames = recording
+    gimbal = ReplayGimbal(path, realtime=False)
+    replayed = []
+    with pytest.raises(EOFError):
+        while True:
+            message = gimbal.read_message()
+            if isinstance(message, RealtimeData3):
+                replayed.append(message)
+    assert replayed[:len(frames)] == frames
+
+
+def test_replay_in_real_time(tmp_path):
+    path = str(tmp_path / 'timed.log')
+    with open(path, 'wb') as file:
+        file.write(MAGIC)
+        for i, timestamp in enumerate((0, 100_000_000, 200_000_000)):
+            file.write(RECORD_HEADER.pack(timestamp, RX, 2) + bytes([i, i]))
+            file.write(RECORD_HEADER.pack(timestamp, TX, 1) + b'x')
+    serial = ReplaySerial(path, realtime=True, speed=2.0, timeout=1)
+    start = monotonic()
+    assert serial.read(2) == b'\0\0'
+    assert serial.in_waiting == 0
+    # a read returns what arrived once it has anything rather than waiting for more
+    assert serial.read(4) == b'\1\1'
+    assert serial.read(4) == b'\2\2'
+    assert 0.09 <= monotonic() - start < 0.5  # 200 ms of recording at double speed
+    with pytest.raises(EOFError):
+        serial.read(1)
@@ -0,0 +1,76 @@
+import random
+from struct import calcsize
+
+import numpy as np
+import pytest
+
+from gimbal import (
+    CMD_BOARD_INFO, CMD_REALTIME_DATA_3, CMD_REALTIME_DATA_CUSTOM, REALTIME_CUSTOM_GYRO_DATA,
+    REALTIME_CUSTOM_IMU_ANGLES, REALTIME_CUSTOM_TARGET_ANGLES, BoardInfo, FrameEncoder, Message, RealtimeCustomLayout,
+    RealtimeData3, decode_message
+)
+from telemetry import decode_frames, find_frames
+
+REALTIME_SIZE = calcsize(RealtimeData3.format().struct_format)
+
+
+def flatten(value):
+    if isinstance(value, bytes):
+        return [float(b) for b in value]
+    if isinstance(value, (tuple, list, np.ndarray)):
+        return [item for v in value for item in flatten(v)]
+    return [float(value)]
+
+
+def random_frames(command_id: int, size: int, count: int, seed: int):
+    rng = random.Random(seed)
+    encoder = FrameEncoder()
+    return [bytes(encoder.encode(command_id, bytes(rng.randrange(256) for _ in range(size)))) for _ in range(count)]
+
+
+def assert_matches(columns, frames, decode):
+    assert len(columns['offset']) == len(frames)
+    for row, data in enumerate(frames):
+        message = Message(*data[:4], payload=data[4:-2])
+        for name, value in decode(message)._asdict().items():
+            if value is None or name not in columns:
+                continue
+            assert flatten(columns[name][row]) == pytest.approx(flatten(value)), name
+
+
+def test_matches_message_decoding():
+    realtime = random_frames(CMD_REALTIME_DATA_3, REALTIME_SIZE, 50, 1)
+    info = random_frames(CMD_BOARD_INFO, calcsize(BoardInfo.format().struct_format), 3, 2)
+    stream = bytearray(b'\x00$$')
+    for i, data in enumerate(realtime):
+        stream += data
+        if i % 20 == 0:
+            stream += info[i // 20] + b'$\x17'  # garbage between frames
+    tables = decode_frames(bytes(stream))
+    assert set(tables) == {CMD_REALTIME_DATA_3, CMD_BOARD_INFO}
+    assert_matches(tables[CMD_REALTIME_DATA_3], realtime, decode_message)
+    assert_matches(tables[CMD_BOARD_INFO], info, decode_message)
+    assert tables[CMD_REALTIME_DATA_3]['imu_angle'].shape == (50, 3)
+    offsets = tables[CMD_REALTIME_DATA_3]['offset']
+    assert bytes(stream[offsets[0]:offsets[0] + len(realtime[0])]) == realtime[0]
+
+
+def test_skips_corrupted_frames(tmp_path):
+    frames = random_frames(CMD_REALTIME_DATA_3, REALTIME_SIZE, 10, 3)
+    bad = bytearray(frames[4])
+    bad[10] ^= 0x40
+    data = b''.join(frames[:4]) + bytes(bad) + b''.join(frames[5:])
+    assert len(find_frames(np.frombuffer(data, np.uint8))) == 9
+
+    path = tmp_path / 'frames.bin'
+    path.write_bytes(data)
+    columns = decode_frames(str(path))[CMD_REALTIME_DATA_3]
+    assert_matches(columns, frames[:4] + frames[5:], decode_message)
+
+
+def test_custom_layout():
+    layout = RealtimeCustomLayout(REALTIME_CUSTOM_IMU_ANGLES | REALTIME_CUSTOM_TARGET_ANGLES | REALTIME_CUSTOM_GYRO_DATA)
+    frames = random_frames(CMD_REALTIME_DATA_CUSTOM, layout.struct.size, 20, 4)
+    assert decode_frames(b''.join(frames)) == {}
+    columns = decode_frames(b''.join(frames), layout)[CMD_REALTIME_DATA_CUSTOM]
+    assert_matches(columns, frames, lambda message: layout.decode(message.payload))
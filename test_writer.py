@@ -0,0 +1,82 @@
+import json
+from threading import Event
+
+import numpy as np
+import pytest
+
+pytest.importorskip('cv2')
+
+from frames import FrameRing  # noqa: E402
+from writer import BLOCK, DROP_NEWEST, DROP_OLDEST, ImageWriter  # noqa: E402
+
+
+def stalled(writer: ImageWriter, release: Event):
+    # keep the single worker busy on its first image until release is set
+    save = writer._save
+    started = Event()
+
+    def blocking_save(*item):
+        started.set()
+        release.wait(5)
+        save(*item)
+    writer._save = blocking_save
+    return started
+
+
+def test_saves_images_and_metadata(tmp_path):
+    ring = FrameRing(2)
+    ring.write(np.full((2, 3), 7, np.uint8), 1.0)
+    frame = ring.checkout()
+    with ImageWriter('raw', workers=2) as writer:
+        assert writer.write(str(tmp_path / 'array'), np.arange(6).reshape(2, 3), {'pose': (0, 1, 2)})
+        assert writer.write(str(tmp_path / 'frame.npy'), frame)
+        writer.flush()
+        assert writer.stats().written == 2
+    assert ring.refs == [0, 0]  # the frame was released once saved
+    assert (np.load(tmp_path / 'array.npy') == np.arange(6).reshape(2, 3)).all()
+    assert (np.load(tmp_path / 'frame.npy') == 7).all()
+    assert json.loads((tmp_path / 'array.json').read_text()) == {'pose': [0, 1, 2]}
+    assert not (tmp_path / 'frame.json').exists()
+    with pytest.raises(RuntimeError):
+        writer.write(str(tmp_path / 'late'), np.zeros(1))
+
+
+@pytest.mark.parametrize('policy, kept', [(DROP_NEWEST, ['a', 'b', 'c']), (DROP_OLDEST, ['a', 'c', 'd'])])
+def test_drop_policies(tmp_path, policy, kept):
+    ring = FrameRing(6)
+    release = Event()
+    writer = ImageWriter('raw', workers=1, queue_size=2, policy=policy)
+    started = stalled(writer, release)
+    results = []
+    for name in 'abcd':
+        ring.write(np.zeros(2, np.uint8), 0.0)
+        results.append(writer.write(str(tmp_path / name), ring.checkout()))
+        if name == 'a':
+            started.wait(5)  # a is being saved, b and c fill the queue
+    assert results == [True, True, True, policy == DROP_OLDEST]
+    assert writer.stats().dropped == 1
+    release.set()
+    writer.close()
+    assert sorted(path.stem for path in tmp_path.iterdir()) == kept
+    assert sum(ring.refs) == 0  # dropped frames are released as well
+
+
+def test_block_waits_for_room(tmp_path):
+    release = Event()
+    writer = ImageWriter('raw', workers=1, queue_size=1, policy=BLOCK)
+    started = stalled(writer, release)
+    writer.write(str(tmp_path / 'a'), np.zeros(1))
+    started.wait(5)
+    writer.write(str(tmp_path / 'b'), np.zeros(1))
+    assert writer.stats().queued == 1
+    release.set()
+    writer.write(str(tmp_path / 'c'), np.zeros(1))  # blocks until b is taken
+    writer.close()
+    assert writer.stats()[:3] == (3, 0, 0)
+
+
+def test_unknown_options():
+    with pytest.raises(ValueError):
+        ImageWriter('gif')
+    with pytest.raises(ValueError):
+        ImageWriter('png', policy='spill')
@@ -0,0 +1,250 @@
+from typing import Callable, Deque, Dict, NamedTuple, Optional, Tuple
+from collections import deque
+from threading import Thread, Event
+from time import monotonic
+import math
+
+import numpy as np
+
+from gimbal import GimbalBase, angle_error
+from control import ControlStreamer
+from pose import PoseTagger, tag_frame
+
+# Finds the target in an image, returns its (x, y) pixel position or None
+Detector = Callable[[np.ndarray], Optional[Tuple[float, float]]]
+
+
+class BrightSpotDetector:
+    """
+    The brightest pixel if it is at least threshold, e.g. for a laser dot or
+    a lamp. Meant for a small grey analysis stream.
+    """
+    def __init__(self, threshold: int = 200):
+        self.threshold = threshold
+
+    def __call__(self, image: np.ndarray) -> Optional[Tuple[float, float]]:
+        if image.ndim == 3:
+            image = image[..., :3].max(axis=2)
+        index = int(np.argmax(image))
+        y, x = divmod(index, image.shape[1])
+        return (x, y) if image[y, x] >= self.threshold else None
+
+
+class Intrinsics(NamedTuple):
+    fx: float  # focal length in pixels
+    fy: float
+    cx: float  # principal point
+    cy: float
+    width: int  # image size the values are given for
+    height: int
+
+    @staticmethod
+    def from_fov(width: int, height: int, horizontal_fov: float) -> 'Intrinsics':
+        """
+        Ideal pinhole camera with square pixels and the given horizontal field of view in degrees.
+        """
+        f = width / 2 / math.tan(math.radians(horizontal_fov) / 2)
+        return Intrinsics(f, f, width / 2, height / 2, width, height)
+
+    def scaled(self, width: int, height: int) -> 'Intrinsics':
+        """
+        The same camera seen through a uniformly scaled stream of width x height.
+        """
+        sx, sy = width / self.width, height / self.height
+        return Intrinsics(self.fx * sx, self.fy * sy, self.cx * sx, self.cy * sy, width, height)
+
+    def angles(self, x: float, y: float, zoom: float = 1.0) -> Tuple[float, float]:
+        """
+        (pitch, yaw) in degrees from the optical axis to pixel (x, y); zoom
+        multiplies the focal length.
+        """
+        yaw = math.degrees(math.atan((x - self.cx) / (self.fx * zoom)))
+        pitch = math.degrees(math.atan((y - self.cy) / (self.fy * zoom)))
+        return pitch, yaw
+
+
+class PID:
+    def __init__(self, kp: float, ki: float = 0.0, kd: float = 0.0, integral_limit: float = 10.0):
+        self.kp = kp
+        self.ki = ki
+        self.kd = kd
+        self.integral_limit = integral_limit
+        self.integral = 0.0
+        self.last_error: Optional[float] = None
+
+    def reset(self):
+        self.integral = 0.0
+        self.last_error = None
+
+    def update(self, error: float, dt: float) -> float:
+        derivative = 0.0
+        if dt > 0:
+            self.integral = max(-self.integral_limit, min(self.integral_limit, self.integral + error * dt))
+            if self.last_error is not None:
+                derivative = (error - self.last_error) / dt
+        self.last_error = error
+        return self.kp * error + self.ki * self.integral + self.kd * derivative
+
+
+class LoopLatency(NamedTuple):
+    capture_to_detect: float  # seconds from capture until the detector got the frame
+    detect: float  # seconds in the detector
+    capture_to_command: float  # seconds from capture until the speed command was queued
+
+
+class Tracker:
+    """
+    Closed loop: detect the target in frames from source (an ISource or one
+    of its outputs), turn its pixel position into an angle with intrinsics,
+    and steer the gimbal with rate limited speed commands.
+
+        detector = BrightSpotDetector()
+        intrinsics = Intrinsics.from_fov(1920, 1080, 60)
+        with Tracker(src.outputs['analysis'], gimbal, detector, intrinsics) as tracker:
+            sleep(60)
+        print_latency(tracker.latency())
+
+    Every frame is joined with the gimbal attitude at its capture time, so the
+    target direction is absolute and the motion since capture does not count
+    as error. With predict=True the target's own angular rate is fed forward
+    and the target is extrapolated to the present. zoom() returns the current
+    focal length multiplier, directions flip the (pitch, yaw) axes to match
+    the mounting.
+    """
+    def __init__(self, source, gimbal: GimbalBase, detector: Detector, intrinsics: Intrinsics,
+                 pitch_pid: Optional[PID] = None, yaw_pid: Optional[PID] = None, rate: float = 100.0,
+                 max_speed: float = 60.0, max_accel: float = 360.0, predict: bool = True,
+                 lost_timeout: float = 0.5, zoom: Callable[[], float] = lambda: 1.0,
+                 directions: Tuple[float, float] = (1.0, 1.0), window: int = 300):
+        self.source = source
+        self.gimbal = gimbal
+        self.detector = detector
+        self.intrinsics = intrinsics
+        self.pids = pitch_pid or PID(4.0, 0.5, 0.05), yaw_pid or PID(4.0, 0.5, 0.05)
+        self.max_speed = max_speed
+        self.max_accel = max_accel
+        self.predict = predict
+        self.lost_timeout = lost_timeout
+        self.zoom = zoom
+        self.directions = directions
+        self.streamer = ControlStreamer(gimbal, rate=rate, repeat=True)
+        self.telemetry = PoseTagger(source, gimbal)
+        self.stopped = Event()
+        self.thread: Optional[Thread] = None
+        self.latencies: Deque[LoopLatency] = deque(maxlen=window)
+        self.scaled: Optional[Intrinsics] = None
+        self.target: Optional[Tuple[float, float, float]] = None  # capture time, pitch, yaw
+        self.target_rate = (0.0, 0.0)
+        self.speeds = (0.0, 0.0)
+        self.command_time = 0.0
+        self.frames = 0
+        self.detections = 0
+
+    def start(self) -> 'Tracker':
+        if self.thread is None:
+            self.telemetry.start()
+            self.streamer.start()
+            self.stopped.clear()
+            self.thread = Thread(target=self._run, name='tracker', daemon=True)
+            self.thread.start()
+        return self
+
+    def stop(self):
+        if self.thread is not None:
+            self.stopped.set()
+            self.thread.join()
+            self.thread = None
+            self.streamer.set_speeds(0, 0, 0)
+            self.streamer.stop()
+            self.telemetry.stop()
+
+    def __enter__(self) -> 'Tracker':
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def _run(self):
+        while not self.stopped.is_set():
+            frame = self.source.read_next(timeout=self.lost_timeout)
+            if frame is None:
+                self._lost()
+                continue
+            with frame:
+                self.frames += 1
+                detect_start = monotonic()
+                point = self.detector(frame.image)
+                detected = monotonic()
+                posed = tag_frame(frame, self.gimbal.history, detected) if point is not None else None
+                shape = frame.image.shape
+            if posed is None:
+                if self.target is None or detected - self.target[0] > self.lost_timeout:
+                    self._lost()
+                continue
+            self.detections += 1
+            self._steer(posed.timestamp, posed.pose.pitch, posed.pose.yaw, point, shape)
+            self.latencies.append(LoopLatency(detect_start - posed.timestamp, detected - detect_start,
+                                              monotonic() - posed.timestamp))
+
+    def _steer(self, timestamp: float, pitch: float, yaw: float, point: Tuple[float, float], shape):
+        height, width = shape[:2]
+        if self.scaled is None or (self.scaled.width, self.scaled.height) != (width, height):
+            self.scaled = self.intrinsics.scaled(width, height)
+        offset = self.scaled.angles(*point, zoom=self.zoom())
+        target = (timestamp, pitch + offset[0] * self.directions[0], yaw + offset[1] * self.directions[1])
+
+        dt = timestamp - self.target[0] if self.target is not None else 0.0
+        if self.predict and dt > 0:
+            measured = [angle_error(t, p) / dt for t, p in zip(target[1:], self.target[1:])]
+            self.target_rate = tuple(0.7 * r + 0.3 * m for r, m in zip(self.target_rate, measured))
+        self.target = target
+
+        latest = self.gimbal.history.latest()
+        now = monotonic()
+        current = (latest[1].pitch, latest[1].yaw) if latest is not None else (pitch, yaw)
+        ahead = now - timestamp if self.predict else 0.0
+        speeds = []
+        for axis in range(2):
+            error = angle_error(target[axis + 1] + self.target_rate[axis] * ahead, current[axis])
+            speed = self.pids[axis].update(error, dt)
+            if self.predict:
+                speed += self.target_rate[axis]
+            speeds.append(speed)
+        self._command(speeds, now)
+
+    def _command(self, speeds, now: float):
+        # limit speed and acceleration so the gimbal is not jerked around by detection noise
+        dt = now - self.command_time if self.command_time else 0.0
+        step = self.max_accel * dt if dt else self.max_speed
+        self.speeds = tuple(
+            max(-self.max_speed, min(self.max_speed, max(last - step, min(last + step, speed))))
+            for speed, last in zip(speeds, self.speeds)
+        )
+        self.command_time = now
+        self.streamer.set_speeds(0, *self.speeds)
+
+    def _lost(self):
+        self.target = None
+        self.target_rate = (0.0, 0.0)
+        for pid in self.pids:
+            pid.reset()
+        if any(self.speeds):
+            self._command((0.0, 0.0), monotonic())
+
+    def latency(self) -> Dict[str, Tuple[float, float, float]]:
+        """
+        (median, 90th percentile, max) seconds of each LoopLatency stage over the recent frames.
+        """
+        result = {}
+        if not self.latencies:
+            return result
+        values = np.array(self.latencies)
+        for i, name in enumerate(LoopLatency._fields):
+            column = values[:, i]
+            result[name] = float(np.median(column)), float(np.percentile(column, 90)), float(column.max())
+        return result
+
+
+def print_latency(report: Dict[str, Tuple[float, float, float]]):
+    for name, (median, p90, worst) in report.items():
+        print(f'{name:20} p50 {median * 1e3:7.2f} ms  p90 {p90 * 1e3:7.2f} ms  max {worst * 1e3:7.2f} ms')
@@ -0,0 +1,161 @@
+from typing import Any, List, NamedTuple, Optional
+from queue import Queue, Full, Empty
+from threading import Thread, Lock
+from time import perf_counter
+import json
+import os
+
+import cv2
+import numpy as np
+
+from frames import FrameRef
+
+# What write() does when the queue is full
+BLOCK = 'block'  # wait for a free place, slowing the caller down to the disk
+DROP_NEWEST = 'drop_newest'  # discard the image being written
+DROP_OLDEST = 'drop_oldest'  # discard the oldest queued image
+
+
+class WriterStats(NamedTuple):
+    written: int
+    dropped: int
+    errors: int
+    queued: int
+    encode_time: float  # average seconds per image
+
+
+class ImageWriter:
+    """
+    Encodes and saves images on a pool of background threads, so capture and
+    motion can go on while the previous images are compressed. OpenCV
+    releases the GIL while encoding, so the threads run in parallel.
+
+        with ImageWriter('jpeg', quality=90) as writer:
+            writer.write('img_001', image, {'pose': pose})
+
+    Images go through a queue of queue_size entries; policy decides what
+    happens when it is full (BLOCK, DROP_NEWEST or DROP_OLDEST). encoder is
+    'png' (compression level), 'jpeg' (quality) or 'raw' (.npy). The file
+    extension is added if the name has none; metadata is saved as JSON next
+    to the image.
+
+    A FrameRef may be passed instead of an array: it is converted to BGR on
+    the writer thread and released when saved, so it keeps its ring buffer
+    checked out while queued.
+    """
+    def __init__(self, encoder: str = 'png', level: int = 3, quality: int = 95, workers: int = 2,
+                 queue_size: int = 8, policy: str = BLOCK):
+        if encoder == 'png':
+            self.extension, self.params = '.png', [cv2.IMWRITE_PNG_COMPRESSION, level]
+        elif encoder == 'jpeg':
+            self.extension, self.params = '.jpg', [cv2.IMWRITE_JPEG_QUALITY, quality]
+        elif encoder == 'raw':
+            self.extension, self.params = '.npy', []
+        else:
+            raise ValueError(f'Unknown encoder: {encoder}')
+        if policy not in (BLOCK, DROP_NEWEST, DROP_OLDEST):
+            raise ValueError(f'Unknown queue policy: {policy}')
+        self.encoder = encoder
+        self.policy = policy
+        self.queue: Queue = Queue(queue_size)
+        self.lock = Lock()
+        self.written = 0
+        self.dropped = 0
+        self.errors = 0
+        self.encode_time = 0.0
+        self.threads: List[Thread] = []
+        for i in range(workers):
+            thread = Thread(target=self._run, name=f'image-writer-{i}', daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def write(self, path: str, image, metadata: Optional[Any] = None) -> bool:
+        """
+        Queue an image (array or FrameRef) for saving. Returns False if it was dropped.
+        """
+        if not self.threads:
+            raise RuntimeError('ImageWriter is closed')
+        if not os.path.splitext(path)[1]:
+            path += self.extension
+        item = path, image, metadata
+        if self.policy == BLOCK:
+            self.queue.put(item)
+            return True
+        while True:
+            try:
+                self.queue.put_nowait(item)
+                return True
+            except Full:
+                if self.policy == DROP_NEWEST:
+                    self._drop(item)
+                    return False
+            try:
+                self._drop(self.queue.get_nowait())
+                self.queue.task_done()
+            except Empty:
+                pass
+
+    def _drop(self, item):
+        if isinstance(item[1], FrameRef):
+            item[1].release()
+        with self.lock:
+            self.dropped += 1
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                self.queue.task_done()
+                return
+            try:
+                self._save(*item)
+            except Exception as e:
+                print(f'Failed to save {item[0]}: {e}')
+                with self.lock:
+                    self.errors += 1
+            finally:
+                if isinstance(item[1], FrameRef):
+                    item[1].release()
+                self.queue.task_done()
+
+    def _save(self, path: str, image, metadata: Optional[Any]):
+        start = perf_counter()
+        if isinstance(image, FrameRef):
+            image = image.bgr() if self.encoder != 'raw' else image.image
+        if self.encoder == 'raw':
+            np.save(path, image)
+        elif not cv2.imwrite(path, image, self.params):
+            raise RuntimeError('cv2.imwrite failed')
+        if metadata is not None:
+            with open(os.path.splitext(path)[0] + '.json', 'w') as file:
+                json.dump(metadata, file, default=str)
+        with self.lock:
+            self.written += 1
+            self.encode_time += perf_counter() - start
+
+    def flush(self):
+        """
+        Wait until every queued image is saved.
+        """
+        self.queue.join()
+
+    def close(self):
+        """
+        Save the queued images and stop the workers.
+        """
+        for _ in self.threads:
+            self.queue.put(None)
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+
+    def __enter__(self) -> 'ImageWriter':
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def stats(self) -> WriterStats:
+        with self.lock:
+            average = self.encode_time / self.written if self.written else 0.0
+            return WriterStats(self.written, self.dropped, self.errors, self.queue.qsize(), average)